@@ -0,0 +1,84 @@
+"""Benchmark `resize-all` cascading against resizing every size from the source.
+
+Resizes a synthetic RGBA image into a set of icon sizes, once by resizing the
+source for every size as separate `resize` calls would, and once through the
+cascade behind `resize-all`. Reports the best wall time of each, and how far the
+cascaded outputs drift from the direct ones.
+
+    python benchmarks/bench_resize.py --source 4096 -z 1024 -z 512 -z 256 -z 128
+"""
+
+import time
+from typing import Callable, List, Sequence, Tuple
+
+import click
+import numpy as np
+from tabulate import tabulate
+
+from nex_imgops import ops
+from nex_imgops.transformer import parse_size
+
+DEFAULT_SIZES = ("1024", "512", "256", "192", "144", "128", "96", "72", "64", "48")
+
+
+def _best_of(repeat: int, func: Callable[[], object]) -> Tuple[float, object]:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ret = func()
+        best = min(best, time.perf_counter() - start)
+    return (best, ret)
+
+
+def _max_diff(lhs: Sequence[np.array], rhs: Sequence[np.array]) -> int:
+    return max(
+        int(np.abs(a.astype(np.int16) - b.astype(np.int16)).max())
+        for (a, b) in zip(lhs, rhs)
+    )
+
+
+@click.command()
+@click.option("--source", type=int, default=2048, help="Source image side in pixels.")
+@click.option(
+    "--size",
+    "-z",
+    "sizes",
+    multiple=True,
+    default=DEFAULT_SIZES,
+    help="Target size as WxH, W or xH. Can be specified multiple times.",
+)
+@click.option(
+    "--algorithm",
+    type=click.Choice(["auto", "nearest", "linear", "cubic", "area"]),
+    default="auto",
+)
+@click.option("--repeat", type=int, default=5, help="Runs per scenario, best is kept.")
+def main(source: int, sizes: Sequence[str], algorithm: str, repeat: int) -> None:
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 256, (source, source, 4), dtype=np.uint8)
+    targets = [parse_size(size) for size in sizes]
+
+    (direct_time, direct) = _best_of(
+        repeat,
+        lambda: [
+            ops.resize(img, width, height, algorithm) for (width, height) in targets
+        ],
+    )
+    (cascade_time, cascade) = _best_of(
+        repeat, lambda: ops.resize_cascade(img, targets, algorithm)
+    )
+
+    results: List[Tuple] = [
+        (f"resize x{len(targets)} (direct)", f"{direct_time:.4f}", "-"),
+        (
+            "resize-all (cascade)",
+            f"{cascade_time:.4f}",
+            _max_diff(direct, cascade),
+        ),
+    ]
+    click.echo(tabulate(results, headers=("Scenario", "Seconds", "Max pixel diff")))
+    click.echo(f"\nSpeedup: {direct_time / cascade_time:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
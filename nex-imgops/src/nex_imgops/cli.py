@@ -1,5 +1,7 @@
+import os.path
 from typing import Any, Optional, Dict, Callable
-from .transformer import Transformer
+from .stream import is_stream_path
+from .transformer import Transformer, parse_size
 from functools import wraps
 
 import click
@@ -20,6 +22,21 @@ _dst_option = click.option(
 )
 
 
+class SizeType(click.ParamType):
+    """A size given as WxH, W or xH."""
+
+    name = "size"
+
+    def convert(
+        self, value: Any, param: Optional[click.Parameter], ctx: Optional[click.Context]
+    ) -> str:
+        try:
+            parse_size(value)
+        except ValueError as ex:
+            self.fail(str(ex), param, ctx)
+        return value
+
+
 class AliasedGroup(click.Group):
     def __init__(self, *kargs, alias_map: Dict[str, str], **kwargs) -> None:
         super().__init__(*kargs, **kwargs)
@@ -37,27 +54,60 @@ class AliasedGroup(click.Group):
 @click.option(
     "--input",
     "-i",
-    type=click.Path(exists=True),
+    type=click.Path(),
+    default=None,
+    help=(
+        "Specify the initial image path, a video file, "
+        "or a numbered frame pattern like frame_%04d.png."
+    ),
+)
+@click.option(
+    "--lookahead",
+    type=click.IntRange(min=1),
+    default=8,
+    help="Maximum number of frames buffered between decoding, processing and encoding.",
+)
+@click.option(
+    "--fps",
+    type=click.FloatRange(min=0, min_open=True),
     default=None,
-    help="Specify the initial image path.",
+    help="Frame rate of saved videos. Defaults to that of the input video.",
 )
 @click.pass_context
 def cli(
-    ctx: click.Context, dst: Optional[str] = None, input: Optional[str] = None
+    ctx: click.Context,
+    dst: Optional[str] = None,
+    input: Optional[str] = None,
+    lookahead: int = 8,
+    fps: Optional[float] = None,
 ) -> None:
     """Transform images using subcommands."""
     ctx.ensure_object(Transformer)
     transformer: Transformer = ctx.obj
+    if input is not None and is_stream_path(input):
+        transformer.stream(dst=dst, path=input, lookahead=lookahead, fps=fps)
+        return
+    if input is not None and not os.path.exists(input):
+        raise click.BadParameter(
+            f"Path '{input}' does not exist.", param_hint="'--input'"
+        )
     transformer.load(dst=dst, path=input)
 
 
+@cli.result_callback()
+@click.pass_context
+def run_stream(ctx: click.Context, *kargs, **kwargs) -> None:
+    transformer: Transformer = ctx.obj
+    transformer.run_stream()
+
+
 def transformer_adaptor(func: Callable):
     def decorator(f: Callable):
         @click.pass_context
         @wraps(func)
         def wrapped(ctx: click.Context, *args, **kwargs):
             transformer: Transformer = ctx.obj
-            func(transformer, *args, **kwargs)
+            transformer.apply(func, *args, **kwargs)
 
         return wrapped
 
@@ -134,6 +184,31 @@ def resize():
     pass
 
 
+@cli.command(name="resize-all")
+@click.argument("path", type=click.Path())
+@_src_option
+@click.option(
+    "--size",
+    "-z",
+    "sizes",
+    type=SizeType(),
+    multiple=True,
+    required=True,
+    help="Target size as WxH, W or xH. Can be specified multiple times.",
+)
+@click.option(
+    "--algorithm",
+    "-a",
+    type=click.Choice(
+        ("auto", "linear", "nearest", "cubic", "area"), case_sensitive=False
+    ),
+    default="auto",
+)
+@transformer_adaptor(Transformer.resize_all)
+def resize_all():
+    pass
+
+
 @cli.command()
 @_src_option
 @_dst_option
@@ -154,11 +229,40 @@ def resize():
     default=0.5,
 )
 @click.option("--color", "-c", type=click.STRING, default="FFF0")
+@click.option(
+    "--restore",
+    "-r",
+    is_flag=True,
+    default=False,
+    help="Restore the canvas removed by an earlier trim before padding.",
+)
 @transformer_adaptor(Transformer.pad)
 def pad():
     pass
 
 
+@cli.command()
+@_src_option
+@_dst_option
+@click.option(
+    "--padding",
+    "-p",
+    type=click.IntRange(min=0),
+    default=0,
+    help="Pixels to keep around the visible area.",
+)
+@click.option(
+    "--threshold",
+    "-t",
+    type=click.IntRange(min=0, max=254),
+    default=0,
+    help="Alpha values at or below this are considered transparent.",
+)
+@transformer_adaptor(Transformer.trim)
+def trim():
+    pass
+
+
 @cli.command("alpha")
 @_src_option
 @_dst_option
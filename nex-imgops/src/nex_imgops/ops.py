@@ -1,9 +1,10 @@
 import click
 import cv2
+import functools
 import numpy as np
 import os.path
 from PIL import Image
-from typing import Optional
+from typing import Dict, List, Optional, Sequence, Tuple
 
 from .utils import (
     parse_color3,
@@ -41,43 +42,102 @@ def clone(img: np.array) -> np.array:
     return img.copy()
 
 
-def resize(
-    img: np.array, width: int = -1, height: int = -1, algorithm: str = "auto"
-) -> np.array:
-    (fh, fw, _) = img.shape
+def _compute_resize_target(
+    fw: int, fh: int, width: int = -1, height: int = -1
+) -> Tuple[int, int, bool]:
+    """Compute the target (width, height, is_shrinking) of resizing fw x fh."""
     if width == -1:
         if height == -1:
-            th = fh
-            tw = fw
-            is_shrinking = False
-        else:
-            th = height
-            tw = (2 * fw * th + fh) // (2 * fh)
-            is_shrinking = fh > th
-    else:
-        if height == -1:
-            tw = width
-            th = (2 * fh * tw + fw) // (2 * fw)
-            is_shrinking = fw > tw
-        else:
-            tw = width
-            th = height
-            is_shrinking = fw * fh > tw * th
-
+            return (fw, fh, False)
+        th = height
+        tw = (2 * fw * th + fh) // (2 * fh)
+        return (tw, th, fh > th)
+    if height == -1:
+        tw = width
+        th = (2 * fh * tw + fw) // (2 * fw)
+        return (tw, th, fw > tw)
+    return (width, height, fw * fh > width * height)
+
+
+def _get_interpolation(algorithm: str, is_shrinking: bool) -> int:
     algorithm = algorithm.lower()
     if algorithm == "linear":
-        interpolation = cv2.INTER_LINEAR
+        return cv2.INTER_LINEAR
     elif algorithm == "cubic":
-        interpolation = cv2.INTER_CUBIC
+        return cv2.INTER_CUBIC
     elif algorithm == "nearest":
-        interpolation = cv2.INTER_NEAREST
+        return cv2.INTER_NEAREST
     elif algorithm == "area":
-        interpolation = cv2.INTER_AREA
+        return cv2.INTER_AREA
     else:
-        interpolation = cv2.INTER_AREA if is_shrinking else cv2.INTER_CUBIC
+        return cv2.INTER_AREA if is_shrinking else cv2.INTER_CUBIC
+
+
+def resize(
+    img: np.array, width: int = -1, height: int = -1, algorithm: str = "auto"
+) -> np.array:
+    (fh, fw, _) = img.shape
+    (tw, th, is_shrinking) = _compute_resize_target(fw, fh, width, height)
+    interpolation = _get_interpolation(algorithm, is_shrinking)
     return cv2.resize(img, (tw, th), interpolation=interpolation)
 
 
+@functools.lru_cache(maxsize=64)
+def plan_resize_cascade(
+    fw: int, fh: int, sizes: Tuple[Tuple[int, int], ...], algorithm: str = "auto"
+) -> Tuple[Tuple[int, int, int, int], ...]:
+    """Plan a mipmap-style cascade of resizes from a fw x fh source.
+
+    Each step is (source step, width, height, interpolation), where source step
+    -1 refers to the original image. Targets are planned from the largest to
+    the smallest, and each one is derived with INTER_AREA from the smallest
+    downscaled target that still covers it, so no step reads more pixels than
+    necessary. Steps are returned in the order of `sizes`.
+    """
+    targets = [_compute_resize_target(fw, fh, w, h) for (w, h) in sizes]
+    order = sorted(range(len(targets)), key=lambda i: -targets[i][0] * targets[i][1])
+    cascade = algorithm.lower() in ("auto", "area")
+    steps: Dict[int, Tuple[int, int, int, int]] = {}
+    produced: List[int] = []  # Downscaled targets, from larger to smaller.
+    for index in order:
+        (tw, th, is_shrinking) = targets[index]
+        source = -1
+        if cascade:
+            for candidate in reversed(produced):
+                (cw, ch, _) = targets[candidate]
+                if cw >= tw and ch >= th:
+                    source = candidate
+                    break
+        if source == -1:
+            interpolation = _get_interpolation(algorithm, is_shrinking)
+        else:
+            interpolation = cv2.INTER_AREA
+        steps[index] = (source, tw, th, interpolation)
+        if tw <= fw and th <= fh:
+            produced.append(index)
+    return tuple(steps[index] for index in range(len(targets)))
+
+
+def resize_cascade(
+    img: np.array, sizes: Sequence[Tuple[int, int]], algorithm: str = "auto"
+) -> List[np.array]:
+    """Resize img into all sizes at once, cascading from larger to smaller ones."""
+    (fh, fw, _) = img.shape
+    plan = plan_resize_cascade(fw, fh, tuple(sizes), algorithm)
+    results: List[Optional[np.array]] = [None] * len(plan)
+    # Larger outputs are always produced before the smaller ones derived from them.
+    for index in sorted(range(len(plan)), key=lambda i: -plan[i][1] * plan[i][2]):
+        (source, tw, th, interpolation) = plan[index]
+        source_img = img if source == -1 else results[source]
+        if source_img.shape[0] == th and source_img.shape[1] == tw:
+            results[index] = source_img
+        else:
+            results[index] = cv2.resize(
+                source_img, (tw, th), interpolation=interpolation
+            )
+    return results
+
+
 def pad(
     img: np.array,
     width: int = 0,
@@ -90,9 +150,20 @@ def pad(
     right = width - left
     top = round(height * py)
     bottom = height - top
+    return pad_margins(img, left, top, right, bottom, color)
+
+
+def pad_margins(
+    img: np.array,
+    left: int = 0,
+    top: int = 0,
+    right: int = 0,
+    bottom: int = 0,
+    color: str = "0000",
+):
     (sh, sw, _) = img.shape
-    dh = sh + height
-    dw = sw + width
+    dh = sh + top + bottom
+    dw = sw + left + right
     ret = np.zeros((dh, dw, 4), dtype=np.uint8)
     ret[:, :, :] = parse_color4(color)
     dst_y_begin = max(top, 0)
@@ -109,6 +180,44 @@ def pad(
     return ret
 
 
+def find_alpha_bounds(
+    img: np.array, threshold: int = 0
+) -> Optional[Tuple[int, int, int, int]]:
+    """Find the (left, top, right, bottom) box with alpha above threshold.
+
+    The box is exclusive on right / bottom. Returns None if there is no such pixel.
+    """
+    mask = img[:, :, 3] > threshold
+    rows = np.flatnonzero(np.any(mask, axis=1))
+    if rows.size == 0:
+        return None
+    cols = np.flatnonzero(np.any(mask, axis=0))
+    return (int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1)
+
+
+def trim(
+    img: np.array, padding: int = 0, threshold: int = 0, in_place: bool = False
+) -> Tuple[np.array, Tuple[int, int, int, int]]:
+    """Crop img to its alpha bounding box, keeping padding pixels around it.
+
+    Returns the cropped image, together with the (left, top, right, bottom) margins
+    that were removed, so that pad_margins can restore the original canvas.
+    When in_place, the cropped image is a view into img.
+    """
+    (height, width, _) = img.shape
+    bounds = find_alpha_bounds(img, threshold)
+    if bounds is None:
+        # Nothing is visible. Keep the image as is, since there is no sensible crop.
+        return (_clone_if_not_in_place(img, in_place), (0, 0, 0, 0))
+    (left, top, right, bottom) = bounds
+    left = max(left - padding, 0)
+    top = max(top - padding, 0)
+    right = min(right + padding, width)
+    bottom = min(bottom + padding, height)
+    cropped = _clone_if_not_in_place(img[top:bottom, left:right, :], in_place)
+    return (cropped, (left, top, width - right, height - bottom))
+
+
 def _clone_if_not_in_place(img: np.array, in_place: bool = False) -> np.array:
     return img if in_place else img.copy()
 
@@ -0,0 +1,224 @@
+import glob
+import os.path
+import queue
+import re
+import threading
+from typing import Iterator, List, Optional, Tuple
+
+import click
+import cv2
+import numpy as np
+
+from . import ops
+
+# Maps video extensions to the fourcc codes used for writing them.
+VIDEO_CODECS = {
+    ".avi": "MJPG",
+    ".m4v": "mp4v",
+    ".mkv": "mp4v",
+    ".mov": "mp4v",
+    ".mp4": "mp4v",
+    ".webm": "VP80",
+}
+DEFAULT_FPS = 30.0
+
+# printf style frame number, e.g. frame_%04d.png
+_FRAME_NUMBER_PATTERN = re.compile(r"%0?(\d*)d")
+
+_END = object()
+
+
+def is_video_path(path: str) -> bool:
+    return os.path.splitext(path)[1].lower() in VIDEO_CODECS
+
+
+def is_frame_pattern(path: str) -> bool:
+    return len(_FRAME_NUMBER_PATTERN.findall(path)) == 1
+
+
+def is_stream_path(path: str) -> bool:
+    return is_frame_pattern(path) or is_video_path(path)
+
+
+def _list_numbered_frames(pattern: str) -> List[Tuple[int, str]]:
+    """List (number, path) of files matching a frame pattern, ordered by number."""
+    match = _FRAME_NUMBER_PATTERN.search(pattern)
+    prefix = pattern[: match.start()]
+    suffix = pattern[match.end() :]
+    number_regex = re.compile(re.escape(prefix) + r"(\d+)" + re.escape(suffix) + "$")
+    frames: List[Tuple[int, str]] = []
+    for path in glob.glob(glob.escape(prefix) + "*" + glob.escape(suffix)):
+        found = number_regex.match(path)
+        if found:
+            frames.append((int(found.group(1)), path))
+    return sorted(frames)
+
+
+def get_start_index(path: str) -> int:
+    """The number of the first frame of a frame pattern, 0 for anything else."""
+    if not is_frame_pattern(path):
+        return 0
+    frames = _list_numbered_frames(path)
+    return frames[0][0] if frames else 0
+
+
+def read_frames(path: str) -> Iterator[np.array]:
+    """Read RGBA frames from a video file or a numbered frame pattern."""
+    if is_frame_pattern(path):
+        # Frames are read as images directly, since VideoCapture drops alpha.
+        for _, frame_path in _list_numbered_frames(path):
+            yield ops.load(frame_path)
+        return
+
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise click.ClickException(f"Unable to open video {path}")
+    try:
+        while True:
+            (success, frame) = capture.read()
+            if not success:
+                break
+            yield cv2.cvtColor(frame, cv2.COLOR_BGR2RGBA)
+    finally:
+        capture.release()
+
+
+def get_frame_rate(path: str) -> Optional[float]:
+    if not is_video_path(path):
+        return None
+    capture = cv2.VideoCapture(path)
+    try:
+        fps = capture.get(cv2.CAP_PROP_FPS)
+    finally:
+        capture.release()
+    return fps if fps > 0 else None
+
+
+def prefetch(frames: Iterator[np.array], lookahead: int) -> Iterator[np.array]:
+    """Decode frames on a background thread, buffering up to lookahead frames."""
+    buffer: queue.Queue = queue.Queue(maxsize=lookahead)
+    stopped = threading.Event()
+    errors: List[BaseException] = []
+
+    def produce() -> None:
+        try:
+            for frame in frames:
+                while not stopped.is_set():
+                    try:
+                        buffer.put(frame, timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+                if stopped.is_set():
+                    return
+        except BaseException as ex:
+            errors.append(ex)
+        finally:
+            buffer.put(_END)
+
+    thread = threading.Thread(target=produce, name="imgops-decode", daemon=True)
+    thread.start()
+    try:
+        while True:
+            frame = buffer.get()
+            if frame is _END:
+                break
+            yield frame
+    finally:
+        stopped.set()
+        # Unblock the producer if it is waiting on a full buffer.
+        while thread.is_alive():
+            try:
+                buffer.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        thread.join()
+    if errors:
+        raise errors[0]
+
+
+class FrameWriter:
+    """Encode frames into a video file or a frame pattern on a background thread.
+
+    Frame patterns are numbered from start_index onwards.
+    """
+
+    def __init__(
+        self, path: str, fps: float, lookahead: int, start_index: int = 0
+    ) -> None:
+        if not is_stream_path(path):
+            raise click.UsageError(
+                f"Cannot save a frame stream to {path}. "
+                "Use a video file or a numbered frame pattern, e.g. frame_%04d.png."
+            )
+        self._path = path
+        self._fps = fps
+        self._queue: queue.Queue = queue.Queue(maxsize=lookahead)
+        self._error: Optional[BaseException] = None
+        self._next_index = start_index
+        self._thread = threading.Thread(
+            target=self._run, name=f"imgops-encode-{path}", daemon=True
+        )
+        self._thread.start()
+
+    def write(self, img: np.array) -> None:
+        if self._error is not None:
+            raise self._error
+        self._queue.put((self._next_index, img))
+        self._next_index += 1
+
+    def close(self) -> None:
+        self._queue.put(_END)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def _run(self) -> None:
+        video_writer: Optional[cv2.VideoWriter] = None
+        try:
+            while True:
+                item = self._queue.get()
+                if item is _END:
+                    break
+                (index, img) = item
+                if is_frame_pattern(self._path):
+                    ops.save(img, self._path % index)
+                    continue
+                (height, width, _) = img.shape
+                if video_writer is None:
+                    fourcc = cv2.VideoWriter_fourcc(
+                        *VIDEO_CODECS[os.path.splitext(self._path)[1].lower()]
+                    )
+                    video_writer = cv2.VideoWriter(
+                        self._path, fourcc, self._fps, (width, height)
+                    )
+                    if not video_writer.isOpened():
+                        raise click.ClickException(
+                            f"Unable to open video {self._path} for writing"
+                        )
+                    size = (width, height)
+                elif size != (width, height):
+                    raise click.ClickException(
+                        f"Frame {index} is {width}x{height}, "
+                        f"but {self._path} is {size[0]}x{size[1]}"
+                    )
+                # Videos have no alpha channel.
+                video_writer.write(cv2.cvtColor(img, cv2.COLOR_RGBA2BGR))
+        except BaseException as ex:
+            self._error = ex
+            # Keep draining until close, so that the producer is not blocked.
+            while self._queue.get() is not _END:
+                pass
+        finally:
+            if video_writer is not None:
+                video_writer.release()
+
+
+def close_writers(writers: List[FrameWriter]) -> None:
+    """Close every writer, even if closing an earlier one raises."""
+    if not writers:
+        return
+    try:
+        writers[0].close()
+    finally:
+        close_writers(writers[1:])
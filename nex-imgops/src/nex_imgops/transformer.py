@@ -1,7 +1,8 @@
 import functools
-from typing import Dict, Optional
+import re
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
 import numpy as np
-from . import ops
+from . import ops, stream
 
 
 def _with_default_str(value: Optional[str], default_value: str) -> str:
@@ -20,6 +21,20 @@ def _with_default_bool(value: Optional[bool], default_value: bool) -> bool:
     return default_value if value is None else value
 
 
+_SIZE_RE = re.compile(r"(\d+)?(?:x(\d+))?", re.IGNORECASE)
+
+
+def parse_size(size: str) -> Tuple[int, int]:
+    """Parse WxH, W or xH into (width, height), with -1 for the missing side."""
+    match = _SIZE_RE.fullmatch(size.strip())
+    if match is None or match.group(1) is None and match.group(2) is None:
+        raise ValueError(f"Invalid size '{size}', expecting WxH, W or xH.")
+    (width, height) = (-1 if value is None else int(value) for value in match.groups())
+    if width == 0 or height == 0:
+        raise ValueError(f"Invalid size '{size}', sides must be at least 1.")
+    return (width, height)
+
+
 class Transformer:
     DEFAULT_SRC = "img"
     DEFAULT_OUTPUT_PATH = "out.png"
@@ -28,9 +43,18 @@ class Transformer:
         self, initial_name: str = DEFAULT_SRC, path: Optional[str] = None
     ) -> None:
         self._context: Dict[str, np.array] = {}
+        # Margins removed by trim, so that pad can restore the original canvas.
+        self._trim_margins: Dict[str, Tuple[int, int, int, int]] = {}
         self._curr = initial_name
         self._dst = self._curr
         self._context[self._curr] = ops.load(path)
+        self._write_image: Callable[[np.array, str], None] = ops.save
+        # When streaming, operations are recorded and replayed for every frame.
+        self._stream_path: Optional[str] = None
+        self._stream_name = self._curr
+        self._stream_lookahead = 8
+        self._stream_fps: Optional[float] = None
+        self._stream_steps: List[Callable[["Transformer"], None]] = []
 
     def wrap_src_dst(func):
         @functools.wraps(func)
@@ -43,22 +67,87 @@ class Transformer:
         ):
             src = _with_default_str(src, self._curr)
             dst = _with_default_str(dst, src)
+            if dst != src:
+                # Trim margins follow the image to its new id.
+                if src in self._trim_margins:
+                    self._trim_margins[dst] = self._trim_margins[src]
+                else:
+                    self._trim_margins.pop(dst, None)
             func(self, src=src, dst=dst, *kargs, **kwargs)
             self._curr = dst
             return self._curr
 
         return inner
 
+    def stream(
+        self,
+        dst: Optional[str] = None,
+        path: Optional[str] = None,
+        lookahead: int = 8,
+        fps: Optional[float] = None,
+    ) -> str:
+        """Stream frames from a video or a numbered frame pattern into dst."""
+        self._curr = _with_default_str(dst, self._curr)
+        self._stream_path = path
+        self._stream_name = self._curr
+        self._stream_lookahead = lookahead
+        self._stream_fps = fps
+        return self._curr
+
+    def apply(self, func: Callable, *kargs, **kwargs) -> None:
+        """Apply an operation now, or record it for every frame when streaming."""
+        if self._stream_path is None:
+            func(self, *kargs, **kwargs)
+        else:
+            self._stream_steps.append(functools.partial(func, *kargs, **kwargs))
+
+    def run_stream(self) -> None:
+        """Run the recorded operations over every frame of the stream.
+
+        Decoding and encoding happen on their own threads, with at most lookahead
+        frames buffered in between, so that they overlap with the processing.
+        """
+        if self._stream_path is None:
+            return
+        fps = self._stream_fps
+        if fps is None:
+            fps = stream.get_frame_rate(self._stream_path) or stream.DEFAULT_FPS
+        start_index = stream.get_start_index(self._stream_path)
+        writers: Dict[str, stream.FrameWriter] = {}
+
+        def write_frame(img: np.array, path: str) -> None:
+            if path not in writers:
+                writers[path] = stream.FrameWriter(
+                    path, fps, self._stream_lookahead, start_index
+                )
+            # Later steps may modify img in place while it is still being encoded.
+            writers[path].write(img.copy())
+
+        self._write_image = write_frame
+        try:
+            for frame in stream.prefetch(
+                stream.read_frames(self._stream_path), self._stream_lookahead
+            ):
+                self._context = {self._stream_name: frame}
+                self._trim_margins = {}
+                self._curr = self._stream_name
+                for step in self._stream_steps:
+                    step(self)
+        finally:
+            self._write_image = ops.save
+            stream.close_writers(list(writers.values()))
+
     def load(self, dst: Optional[str] = None, path: Optional[str] = None) -> str:
         """Load an image to dst."""
         self._curr = _with_default_str(dst, self._curr)
         self._context[self._curr] = ops.load(path)
+        self._trim_margins.pop(self._curr, None)
         return self._curr
 
     def save(self, src: Optional[str] = None, path: Optional[str] = None) -> str:
         """Save an image from src to a file."""
         self._curr = _with_default_str(src, self._curr)
-        ops.save(
+        self._write_image(
             self._context[self._curr], _with_default_str(path, self.DEFAULT_OUTPUT_PATH)
         )
         return self._curr
@@ -77,6 +166,7 @@ class Transformer:
             _with_default_int(height, 1),
             _with_default_str(color, "white"),
         )
+        self._trim_margins.pop(self._curr, None)
         return self._curr
 
     @wrap_src_dst
@@ -99,6 +189,31 @@ class Transformer:
             self._context[src], width, height, _with_default_str(algorithm, "auto")
         )
 
+    def resize_all(
+        self,
+        src: Optional[str] = None,
+        sizes: Sequence[str] = (),
+        path: Optional[str] = None,
+        algorithm: Optional[str] = "auto",
+    ) -> str:
+        """Resizes src into multiple sizes and saves each of them to a file.
+
+        The path may contain {width}, {height} and {index} placeholders.
+        """
+        self._curr = _with_default_str(src, self._curr)
+        path = _with_default_str(path, "out_{width}x{height}.png")
+        outputs = ops.resize_cascade(
+            self._context[self._curr],
+            [parse_size(size) for size in sizes],
+            _with_default_str(algorithm, "auto"),
+        )
+        for index, output in enumerate(outputs):
+            (height, width, _) = output.shape
+            self._write_image(
+                output, path.format(width=width, height=height, index=index)
+            )
+        return self._curr
+
     @wrap_src_dst
     def pad(
         self,
@@ -109,16 +224,43 @@ class Transformer:
         px: Optional[float] = None,
         py: Optional[float] = None,
         color: Optional[str] = None,
+        restore: Optional[bool] = None,
     ) -> None:
         """Pads pixels around the image."""
+        color = _with_default_str(color, "0000")
+        if _with_default_bool(restore, False) and src in self._trim_margins:
+            # Undo the trim, before applying the regular padding.
+            img = ops.pad_margins(self._context[src], *self._trim_margins[src], color)
+            self._trim_margins.pop(dst, None)
+        else:
+            img = self._context[src]
         self._context[dst] = ops.pad(
-            self._context[src],
+            img,
             _with_default_int(width, 0),
             _with_default_int(height, 0),
             _with_default_float(px, 0.5),
             _with_default_float(py, 0.5),
-            _with_default_str(color, "0000"),
+            color,
+        )
+
+    @wrap_src_dst
+    def trim(
+        self,
+        src: str,
+        dst: str,
+        padding: Optional[int] = None,
+        threshold: Optional[int] = None,
+    ) -> None:
+        """Crops away the transparent margins around the image."""
+        (self._context[dst], margins) = ops.trim(
+            self._context[src],
+            _with_default_int(padding, 0),
+            _with_default_int(threshold, 0),
+            in_place=src == dst,
         )
+        # Accumulate with any earlier trim, so that pad --restore undoes both.
+        previous = self._trim_margins.get(src, (0, 0, 0, 0))
+        self._trim_margins[dst] = tuple(a + b for (a, b) in zip(previous, margins))
 
     @wrap_src_dst
     def extract_alpha(self, src: str, dst: str, color: Optional[str] = None) -> None:
@@ -0,0 +1,192 @@
+"""Benchmark the Bitrise paths of nex-nbp against a local fake Bitrise API.
+
+Times the methods of the Bitrise Client: listing apps, finding and downloading post
+builds, triggering builds as `nbp trigger` does and watching them as `nbp trigger
+--watch` and `nbp builds watch` do. Reports wall time, request count and opened
+connections for each, so that pooling, caching and concurrency changes can be
+compared offline. A full scan of the post builds of an app, as when none matches the
+requested workflows, is run both with a connection per request and with the pooled
+session.
+
+`nbp list` and `nbp builds apk` are not covered end to end, since they go through
+BitriseIndexClient, which the fake does not serve. Neither is resolving the app of
+the other commands, which uses it too.
+
+    python benchmarks/bench_bitrise.py --latency 0.1 --bandwidth 4
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import tempfile
+import time
+from typing import Callable, List, Tuple
+
+import click
+import requests
+from tabulate import tabulate
+
+from fake_bitrise import FakeBitrise, FakeBitriseConfig
+from nex_nbp.bitrise.cache import BuildCache
+from nex_nbp.bitrise.client import Client
+from nex_nbp.bitrise.watch import BuildWatcher, WatchedBuild
+
+APP_SLUG = "app0"
+
+
+class _UnpooledClient(Client):
+    """Opens a connection for every request, as the client did before pooling."""
+
+    @classmethod
+    def _create_session(cls) -> requests.Session:
+        session = super()._create_session()
+        session.headers["Connection"] = "close"
+        return session
+
+
+def _measure(
+    server: FakeBitrise, results: List[Tuple], name: str, func: Callable[[], object]
+) -> object:
+    server.reset_counts()
+    start = time.perf_counter()
+    ret = func()
+    elapsed = time.perf_counter() - start
+    results.append((name, f"{elapsed:.2f}", server.total_requests, server.connections))
+    return ret
+
+
+@click.command()
+@click.option("--latency", type=float, default=0.05, help="Seconds per response.")
+@click.option("--page-size", type=int, default=50, help="Items per listing page.")
+@click.option("--apps", "num_apps", type=int, default=120, help="Number of apps.")
+@click.option(
+    "--builds", "num_builds", type=int, default=200, help="Post builds per app."
+)
+@click.option("--artifact-size", type=int, default=32, help="Apk size in MiB.")
+@click.option(
+    "--bandwidth",
+    type=float,
+    default=0,
+    help="MiB/s per download connection, 0 for no limit.",
+)
+@click.option(
+    "--failure-rate",
+    type=float,
+    default=0.0,
+    help="Fraction of requests failing with 503.",
+)
+@click.option(
+    "--segments", type=int, default=4, help="Segments for the segmented download."
+)
+def main(
+    latency: float,
+    page_size: int,
+    num_apps: int,
+    num_builds: int,
+    artifact_size: int,
+    bandwidth: float,
+    failure_rate: float,
+    segments: int,
+) -> None:
+    config = FakeBitriseConfig(
+        num_apps=num_apps,
+        num_builds=num_builds,
+        page_size=page_size,
+        artifact_size=artifact_size << 20,
+        latency=latency,
+        bandwidth=int(bandwidth * (1 << 20)),
+        failure_rate=failure_rate,
+    )
+    results: List[Tuple] = []
+    with FakeBitrise(config) as server, tempfile.TemporaryDirectory() as tmp_dir:
+        client = Client(
+            api_key="fake",
+            org_slug="fake",
+            cache=BuildCache(Path(tmp_dir) / "cache.sqlite3"),
+            api_url=server.api_url,
+        )
+        workflows = config.workflows
+
+        _measure(server, results, "get_apps", client.get_apps)
+
+        def find_post_builds():
+            return client.get_post_builds(APP_SLUG, config.branch, workflows)
+
+        post_builds = _measure(
+            server, results, "get_post_builds (cold)", find_post_builds
+        )
+        _measure(server, results, "get_post_builds (cached)", find_post_builds)
+
+        # No workflow matches, so every post build of the app is inspected.
+        for name, client_class in (
+            ("connection per request", _UnpooledClient),
+            ("pooled", Client),
+        ):
+            scan_client = client_class(
+                api_key="fake",
+                org_slug="fake",
+                cache=BuildCache(Path(tmp_dir) / f"scan-{len(results)}.sqlite3"),
+                api_url=server.api_url,
+            )
+            _measure(
+                server,
+                results,
+                f"get_post_builds: scan {num_builds} builds ({name})",
+                lambda: scan_client.get_post_builds(
+                    APP_SLUG, config.branch, ["unknown_workflow"]
+                ),
+            )
+            scan_client.close()
+
+        (build, apk_artifact) = next(iter(post_builds.values()))
+        for num_segments in (1, segments):
+            out_dir = Path(tmp_dir) / f"out{num_segments}"
+            out_dir.mkdir()
+            _measure(
+                server,
+                results,
+                f"download_apk ({num_segments} segments)",
+                lambda: client.download_apk(
+                    APP_SLUG, build, apk_artifact, str(out_dir), segments=num_segments
+                ),
+            )
+
+        def trigger_sequential():
+            return [
+                client.build(APP_SLUG, workflow, config.branch)
+                for workflow in workflows
+            ]
+
+        def trigger_concurrent():
+            with ThreadPoolExecutor(max_workers=len(workflows)) as executor:
+                futures = [
+                    executor.submit(client.build, APP_SLUG, workflow, config.branch)
+                    for workflow in workflows
+                ]
+            return [future.result() for future in futures]
+
+        _measure(server, results, "build (sequential)", trigger_sequential)
+        triggered = _measure(
+            server, results, "build (concurrent, as nbp trigger)", trigger_concurrent
+        )
+
+        watched = [
+            WatchedBuild(response["build_slug"], response["build_number"], workflow)
+            for workflow, (status_code, _, response) in zip(workflows, triggered)
+            if status_code == 201
+        ]
+        watcher = BuildWatcher(client, APP_SLUG, min_interval=0.2, max_interval=1.0)
+        _measure(
+            server,
+            results,
+            "BuildWatcher.watch (nbp builds watch)",
+            lambda: watcher.watch(watched),
+        )
+        client.close()
+
+    click.echo(
+        tabulate(results, headers=("Scenario", "Seconds", "Requests", "Connections"))
+    )
+
+
+if __name__ == "__main__":
+    main()
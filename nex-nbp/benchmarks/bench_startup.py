@@ -0,0 +1,127 @@
+"""Benchmark the startup cost of nex-nbp, and of resolving the git remote and branch.
+
+Times `import nex_nbp.cli` and `nbp --help` in fresh processes, next to a bare
+interpreter and an import of GitPython, which nex-nbp no longer loads. Then resolves
+the origin url and the tracked branch of a scratch repo in-process, with GitInfo and,
+if it is installed, with GitPython. Reports the median of every scenario.
+
+    python benchmarks/bench_startup.py --runs 20
+"""
+
+from pathlib import Path
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, List, Tuple
+
+import click
+from tabulate import tabulate
+
+from nex_nbp.git import GitInfo
+
+_NBP_CLI = "import sys\nfrom nex_nbp import cli\ncli(sys.argv[1:], prog_name='nbp')\n"
+
+
+def _median_ms(runs: int, func: Callable[[], object]) -> float:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def _run_python(*args: str) -> None:
+    subprocess.run(
+        [sys.executable, *args],
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def _create_repo(path: Path) -> None:
+    def git(*args: str) -> None:
+        subprocess.run(["git", *args], cwd=path, check=True, capture_output=True)
+
+    git("init", "-q", "-b", "feature")
+    git("remote", "add", "origin", "git@github.com:nex/olympia.git")
+    git("config", "branch.feature.remote", "origin")
+    git("config", "branch.feature.merge", "refs/heads/main")
+
+
+def _resolve_with_git_info(path: Path) -> Tuple:
+    git_info = GitInfo(str(path))
+    return (git_info.remote_url, git_info.remote_name)
+
+
+def _resolve_with_git_python(path: Path) -> Tuple:
+    import git
+
+    repo = git.Repo(path)
+    tracking = repo.active_branch.tracking_branch()
+    return (repo.remotes.origin.url, tracking.remote_head)
+
+
+@click.command()
+@click.option("--runs", type=int, default=10, help="Runs per process scenario.")
+@click.option("--calls", type=int, default=200, help="Calls per in-process scenario.")
+def main(runs: int, calls: int) -> None:
+    results: List[Tuple] = [
+        ("python -c pass", _median_ms(runs, lambda: _run_python("-c", "pass")), runs),
+        (
+            "import nex_nbp.cli",
+            _median_ms(runs, lambda: _run_python("-c", "import nex_nbp.cli")),
+            runs,
+        ),
+        (
+            "nbp --help",
+            _median_ms(runs, lambda: _run_python("-c", _NBP_CLI, "--help")),
+            runs,
+        ),
+    ]
+    try:
+        _run_python("-c", "import git")
+        has_git_python = True
+    except subprocess.CalledProcessError:
+        has_git_python = False
+    if has_git_python:
+        results.append(
+            (
+                "import git (GitPython)",
+                _median_ms(runs, lambda: _run_python("-c", "import git")),
+                runs,
+            )
+        )
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir)
+        _create_repo(path)
+        results.append(
+            (
+                "resolve url and branch (GitInfo)",
+                _median_ms(calls, lambda: _resolve_with_git_info(path)),
+                calls,
+            )
+        )
+        if has_git_python:
+            assert _resolve_with_git_info(path) == _resolve_with_git_python(path)
+            results.append(
+                (
+                    "resolve url and branch (GitPython)",
+                    _median_ms(calls, lambda: _resolve_with_git_python(path)),
+                    calls,
+                )
+            )
+
+    click.echo(
+        tabulate(results, headers=("Scenario", "Median ms", "Runs"), floatfmt=".2f")
+    )
+    if not has_git_python:
+        click.echo("\nGitPython is not installed, its scenarios are skipped.")
+
+
+if __name__ == "__main__":
+    main()
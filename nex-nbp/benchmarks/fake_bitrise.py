@@ -0,0 +1,388 @@
+"""A local stand-in for the parts of the Bitrise API used by nex-nbp.
+
+Serves apps, paged build listings, post build artifacts (env_vars.json and an apk,
+with Range support) and build triggers, with configurable latency, bandwidth and
+failure injection. Requests are counted per route and accepted connections in
+total, so benchmarks can compare wall time, round trips and connection reuse.
+"""
+
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+POST_BUILD_WORKFLOW = "ucb_post_build"
+# Builds are triggered ten minutes apart, in the order of their build numbers.
+_FIRST_TRIGGER = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def _build_time(build_number: int, seconds: int = 0) -> str:
+    value = _FIRST_TRIGGER + timedelta(minutes=10 * build_number, seconds=seconds)
+    return value.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _parse_build_time(value: str) -> float:
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+@dataclass
+class FakeBitriseConfig:
+    num_apps: int = 120
+    # Post builds per app, from build number num_builds down to 1.
+    num_builds: int = 200
+    page_size: int = 50
+    artifact_size: int = 32 << 20
+    # Seconds added to every response.
+    latency: float = 0.05
+    # Bytes per second per download connection, 0 for unlimited.
+    bandwidth: int = 0
+    # Probability of answering a request with a 503.
+    failure_rate: float = 0.0
+    # Seconds a triggered build spends queued, then running.
+    queue_time: float = 1.0
+    run_time: float = 2.0
+    workflows: List[str] = field(
+        default_factory=lambda: [
+            "build_olympia_apk_staging",
+            "build_olympia_apk_production",
+            "build_android_apk_sky_beta_staging",
+            "build_android_apk_sky_beta",
+        ]
+    )
+    branch: str = "main"
+    seed: int = 0
+
+
+class FakeBitrise:
+    """In-process fake Bitrise API server, usable as a context manager."""
+
+    def __init__(self, config: Optional[FakeBitriseConfig] = None):
+        self.config = FakeBitriseConfig() if config is None else config
+        self.requests: Counter = Counter()
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._random = random.Random(self.config.seed)
+        self._payload = bytes(range(256)) * (self.config.artifact_size // 256 + 1)
+        self._triggered: Dict[str, List[Dict]] = {}
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        (host, port) = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def api_url(self) -> str:
+        return f"{self.url}/v0.1"
+
+    def start(self) -> "FakeBitrise":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeBitrise":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def reset_counts(self) -> None:
+        with self._lock:
+            self.requests.clear()
+            self.connections = 0
+
+    @property
+    def total_requests(self) -> int:
+        with self._lock:
+            return sum(self.requests.values())
+
+    def _should_fail(self) -> bool:
+        with self._lock:
+            return self._random.random() < self.config.failure_rate
+
+    def _count(self, route: str) -> None:
+        with self._lock:
+            self.requests[route] += 1
+
+    def _count_connection(self) -> None:
+        with self._lock:
+            self.connections += 1
+
+    # Data model.
+
+    def _app(self, index: int) -> Dict:
+        return {
+            "slug": f"app{index}",
+            "title": f"App {index}",
+            "project_type": "android",
+        }
+
+    def _post_build(self, app_slug: str, build_number: int) -> Dict:
+        return {
+            "slug": f"{app_slug}-{build_number}",
+            "build_number": build_number,
+            "status": 1,
+            "status_text": "success",
+            "triggered_workflow": POST_BUILD_WORKFLOW,
+            "branch": self.config.branch,
+            "triggered_at": _build_time(build_number),
+            "started_on_worker_at": _build_time(build_number, 10),
+            "finished_at": _build_time(build_number, 300),
+        }
+
+    def _triggered_build(self, build: Dict) -> Dict:
+        elapsed = time.time() - build["created"]
+        data = {key: value for key, value in build.items() if key != "created"}
+        if elapsed >= self.config.queue_time:
+            data["started_on_worker_at"] = _build_time(build["build_number"], 10)
+        if elapsed >= self.config.queue_time + self.config.run_time:
+            data.update(
+                status=1,
+                status_text="success",
+                finished_at=_build_time(build["build_number"], 300),
+            )
+        return data
+
+    def _list_builds(self, app_slug: str, query: Dict[str, str]) -> List[Dict]:
+        with self._lock:
+            triggered = [
+                self._triggered_build(b) for b in self._triggered.get(app_slug, [])
+            ]
+        builds = triggered[::-1] + [
+            self._post_build(app_slug, number)
+            for number in range(self.config.num_builds, 0, -1)
+        ]
+        if "workflow" in query:
+            builds = [b for b in builds if b["triggered_workflow"] == query["workflow"]]
+        if "build_number" in query:
+            builds = [
+                b for b in builds if b["build_number"] == int(query["build_number"])
+            ]
+        if "status" in query:
+            builds = [b for b in builds if b["status"] == int(query["status"])]
+        if "branch" in query:
+            builds = [b for b in builds if b["branch"] == query["branch"]]
+        if "before" in query:
+            builds = [
+                b
+                for b in builds
+                if _parse_build_time(b["triggered_at"]) < int(query["before"])
+            ]
+        return builds
+
+    def _find_build(self, app_slug: str, build_slug: str) -> Optional[Dict]:
+        with self._lock:
+            for build in self._triggered.get(app_slug, []):
+                if build["slug"] == build_slug:
+                    return self._triggered_build(build)
+        match = re.fullmatch(rf"{re.escape(app_slug)}-(\d+)", build_slug)
+        if match is None or not 0 < int(match.group(1)) <= self.config.num_builds:
+            return None
+        return self._post_build(app_slug, int(match.group(1)))
+
+    def _artifacts(self, app_slug: str, build_slug: str) -> List[Dict]:
+        return [
+            {
+                "slug": "env",
+                "title": "env_vars.json",
+                "artifact_type": "file",
+                "file_size_bytes": 256,
+            },
+            {
+                "slug": "apk",
+                "title": f"{build_slug}.apk",
+                "artifact_type": "android-apk",
+                "file_size_bytes": self.config.artifact_size,
+            },
+        ]
+
+    def _env_vars(self, build_slug: str) -> Dict:
+        build_number = int(build_slug.rsplit("-", 1)[1])
+        workflows = self.config.workflows
+        return {
+            "TRIGGER_STAGE_BITRISE_TRIGGERED_WORKFLOW_ID": workflows[
+                build_number % len(workflows)
+            ],
+            "TRIGGER_STAGE_BITRISE_GIT_BRANCH": self.config.branch,
+        }
+
+    def _paginate(self, items: List[Dict], query: Dict[str, str]) -> Dict:
+        limit = min(
+            int(query.get("limit", self.config.page_size)), self.config.page_size
+        )
+        start = int(query.get("next", 0))
+        paging: Dict = {"page_item_limit": limit, "total_item_count": len(items)}
+        if start + limit < len(items):
+            paging["next"] = str(start + limit)
+        return {"data": items[start : start + limit], "paging": paging}
+
+    def _trigger(self, app_slug: str, body: Dict) -> Dict:
+        params = body.get("build_params", {})
+        with self._lock:
+            builds = self._triggered.setdefault(app_slug, [])
+            build_number = self.config.num_builds + len(builds) + 1
+            build_slug = f"{app_slug}-t{build_number}"
+            builds.append(
+                {
+                    "slug": build_slug,
+                    "build_number": build_number,
+                    "status": 0,
+                    "status_text": "in-progress",
+                    "triggered_workflow": params.get("workflow_id"),
+                    "branch": params.get("branch"),
+                    "triggered_at": _build_time(build_number),
+                    "started_on_worker_at": None,
+                    "created": time.time(),
+                }
+            )
+        return {
+            "status": "ok",
+            "build_number": build_number,
+            "build_slug": build_slug,
+            "build_url": f"{self.url}/build/{build_slug}",
+            "triggered_workflow": params.get("workflow_id"),
+        }
+
+    # HTTP handling.
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are written separately, which Nagle's algorithm would
+            # delay on kept-alive connections.
+            disable_nagle_algorithm = True
+
+            def setup(self) -> None:
+                # Called once per accepted connection, however many requests it serves.
+                super().setup()
+                fake._count_connection()
+
+            def log_message(self, format, *args) -> None:
+                pass
+
+            def _send_json(self, status: int, data: Dict) -> None:
+                body = json.dumps(data).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_range(self, payload: memoryview) -> None:
+                size = len(payload)
+                (start, end) = (0, size - 1)
+                match = re.fullmatch(
+                    r"bytes=(\d+)-(\d*)", self.headers.get("Range", "")
+                )
+                if match is not None:
+                    start = int(match.group(1))
+                    end = min(int(match.group(2) or size - 1), size - 1)
+                    self.send_response(206)
+                    self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+                else:
+                    self.send_response(200)
+                self.send_header("Content-Length", str(end + 1 - start))
+                self.send_header("Accept-Ranges", "bytes")
+                self.end_headers()
+                chunk_size = 64 << 10
+                bandwidth = fake.config.bandwidth
+                for offset in range(start, end + 1, chunk_size):
+                    chunk = payload[offset : min(offset + chunk_size, end + 1)]
+                    self.wfile.write(chunk)
+                    if bandwidth:
+                        time.sleep(len(chunk) / bandwidth)
+
+            def _route(self, method: str) -> Tuple[str, Optional[Tuple]]:
+                path = urlparse(self.path).path
+                routes = (
+                    ("apps", r"/v0\.1/apps"),
+                    ("builds", r"/v0\.1/apps/([^/]+)/builds"),
+                    ("build", r"/v0\.1/apps/([^/]+)/builds/([^/]+)"),
+                    ("artifacts", r"/v0\.1/apps/([^/]+)/builds/([^/]+)/artifacts"),
+                    (
+                        "artifact",
+                        r"/v0\.1/apps/([^/]+)/builds/([^/]+)/artifacts/([^/]+)",
+                    ),
+                    ("file", r"/files/([^/]+)/([^/]+)/([^/]+)"),
+                )
+                for name, pattern in routes:
+                    match = re.fullmatch(pattern, path)
+                    if match is not None:
+                        return (f"{method} {name}", match.groups())
+                return (f"{method} unknown", None)
+
+            def _handle(self, method: str) -> None:
+                (route, args) = self._route(method)
+                fake._count(route)
+                body = b""
+                if "Content-Length" in self.headers:
+                    body = self.rfile.read(int(self.headers["Content-Length"]))
+                time.sleep(fake.config.latency)
+                if args is None:
+                    self._send_json(404, {"message": "Not found"})
+                    return
+                if fake._should_fail():
+                    self._send_json(503, {"message": "Injected failure"})
+                    return
+                query = {
+                    k: v[-1] for k, v in parse_qs(urlparse(self.path).query).items()
+                }
+
+                if route == "GET apps":
+                    apps = [fake._app(i) for i in range(fake.config.num_apps)]
+                    self._send_json(200, fake._paginate(apps, query))
+                elif route == "GET builds":
+                    builds = fake._list_builds(args[0], query)
+                    self._send_json(200, fake._paginate(builds, query))
+                elif route == "POST builds":
+                    self._send_json(201, fake._trigger(args[0], json.loads(body)))
+                elif route == "GET build":
+                    build = fake._find_build(*args)
+                    if build is None:
+                        self._send_json(404, {"message": "Not found"})
+                    else:
+                        self._send_json(200, {"data": build})
+                elif route == "GET artifacts":
+                    self._send_json(200, {"data": fake._artifacts(*args)})
+                elif route == "GET artifact":
+                    (app_slug, build_slug, artifact_slug) = args
+                    artifact = next(
+                        a
+                        for a in fake._artifacts(app_slug, build_slug)
+                        if a["slug"] == artifact_slug
+                    )
+                    url = f"{fake.url}/files/{app_slug}/{build_slug}/{artifact_slug}"
+                    self._send_json(
+                        200, {"data": {**artifact, "expiring_download_url": url}}
+                    )
+                elif route == "GET file":
+                    (app_slug, build_slug, artifact_slug) = args
+                    if artifact_slug == "env":
+                        self._send_json(200, fake._env_vars(build_slug))
+                    else:
+                        payload = memoryview(fake._payload)
+                        self._send_range(payload[: fake.config.artifact_size])
+                else:
+                    self._send_json(405, {"message": "Method not allowed"})
+
+            def do_GET(self) -> None:
+                self._handle("GET")
+
+            def do_POST(self) -> None:
+                self._handle("POST")
+
+        return Handler
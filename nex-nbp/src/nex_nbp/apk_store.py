@@ -0,0 +1,126 @@
+import hashlib
+import os
+import os.path
+from pathlib import Path
+import shutil
+from typing import List, NamedTuple, Optional, Tuple
+
+from nexcli.common import Config, persistance_dir
+
+
+class ApkKey(NamedTuple):
+    app_code: str
+    build_num: int
+    name: str
+    byte_size: int
+
+    @property
+    def digest(self) -> str:
+        return hashlib.sha256(
+            f"{self.app_code}\0{self.build_num}\0{self.name}\0{self.byte_size}".encode()
+        ).hexdigest()
+
+
+class ApkStore:
+    """Local store of downloaded apks, so that the same build is only downloaded once.
+
+    Entries are linked into the output directory. The least recently used entries are
+    evicted once the store grows beyond its size cap. Their last use is recorded in
+    separate files, since hardlinked entries share their modified time with the output.
+    """
+
+    DEFAULT_ROOT = persistance_dir / "apk_store"
+    DEFAULT_MAX_BYTES = 10 << 30
+    _CONFIG_SECTION = "apk_store"
+
+    def __init__(self, root: Optional[Path] = None, max_bytes: Optional[int] = None):
+        self._root = self.DEFAULT_ROOT if root is None else root
+        if max_bytes is None:
+            max_bytes = Config.get("nbp").int(
+                self._CONFIG_SECTION, "max_bytes", fallback=self.DEFAULT_MAX_BYTES
+            )
+        self._max_bytes = max_bytes
+
+    def _get_path(self, key: ApkKey) -> Path:
+        digest = key.digest
+        return self._root / digest[:2] / f"{digest}{os.path.splitext(key.name)[1]}"
+
+    def _get_used_file(self, path: Path) -> Path:
+        # Entry names are the digest and the extension of the apk.
+        return self._root / "last_used" / path.stem
+
+    def _mark_used(self, path: Path) -> None:
+        used_file = self._get_used_file(path)
+        used_file.parent.mkdir(parents=True, exist_ok=True)
+        used_file.touch()
+
+    def get(self, key: ApkKey) -> Optional[Path]:
+        path = self._get_path(key)
+        try:
+            if path.stat().st_size != key.byte_size:
+                return None
+        except FileNotFoundError:
+            return None
+        self._mark_used(path)
+        return path
+
+    @classmethod
+    def _link(cls, src: Path, dst: str) -> None:
+        tmp = f"{dst}.link"
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        try:
+            os.link(src, tmp)
+        except OSError:
+            # Different file systems, or one without hardlinks. This makes a full copy.
+            shutil.copyfile(src, tmp)
+        os.replace(tmp, dst)
+
+    def link_into(self, key: ApkKey, output_file: str) -> bool:
+        """Put the stored apk at output_file. Returns False if it is not stored."""
+        path = self.get(key)
+        if path is None:
+            return False
+        self._link(path, output_file)
+        return True
+
+    def add(self, key: ApkKey, file: str) -> None:
+        path = self._get_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._link(Path(file), str(path))
+        self._mark_used(path)
+        self.prune()
+
+    def _list_entries(self) -> List[Tuple[float, int, Path]]:
+        """List (last used, size, path) of all entries."""
+        entries = []
+        if not self._root.is_dir():
+            return entries
+        # Entries are in directories named by the first two characters of their digest.
+        for path in self._root.glob("??/*"):
+            stat = path.stat()
+            try:
+                last_used = self._get_used_file(path).stat().st_mtime
+            except FileNotFoundError:
+                last_used = stat.st_mtime
+            entries.append((last_used, stat.st_size, path))
+        return entries
+
+    def prune(self, max_bytes: Optional[int] = None) -> Tuple[int, int]:
+        """Evict the least recently used entries until the store fits into max_bytes.
+
+        Returns the number of evicted entries and the bytes freed.
+        """
+        max_bytes = self._max_bytes if max_bytes is None else max_bytes
+        entries = sorted(self._list_entries())
+        total = sum(size for (_, size, _) in entries)
+        num_removed = 0
+        freed = 0
+        for _, size, path in entries:
+            if total - freed <= max_bytes:
+                break
+            path.unlink()
+            self._get_used_file(path).unlink(missing_ok=True)
+            num_removed += 1
+            freed += size
+        return (num_removed, freed)
@@ -0,0 +1,173 @@
+from collections import Counter
+import dataclasses
+import hashlib
+import json
+import os
+from pathlib import Path
+import time
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from nex_bitrise_index.interface import AppEntry
+from nexcli.common import persistance_dir
+
+# Score tiers, higher is better. Within a tier, titles closer to the query rank first.
+_SCORE_CODE = 4.0
+_SCORE_SUBSTRING = 2.0
+_SCORE_SUBSEQUENCE = 1.0
+# Minimum fraction of the query trigrams a title needs to be a typo-tolerant match.
+_MIN_TRIGRAM_OVERLAP = 0.5
+
+
+def _normalize(text: str) -> str:
+    return text.lower().replace(" ", "")
+
+
+def _trigrams(text: str) -> Set[str]:
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+def _is_subsequence(needle: str, haystack: str) -> bool:
+    chars = iter(haystack)
+    return all(ch in chars for ch in needle)
+
+
+class AppIndex:
+    """Normalized lookup index over the Bitrise apps, for matching an app name.
+
+    Holds a code map, the normalized titles and a trigram index over the titles, so a
+    lookup only scores the apps sharing trigrams with the name.
+    """
+
+    DEFAULT_PATH = persistance_dir / "nbp_app_index.json"
+    # A stored app list older than this is served, but refreshed in the background.
+    MAX_AGE = 10 * 60.0
+
+    def __init__(
+        self,
+        apps: Sequence[AppEntry],
+        titles: Optional[List[str]] = None,
+        trigram_index: Optional[Dict[str, List[int]]] = None,
+        fetched_at: Optional[float] = None,
+    ):
+        self.apps = list(apps)
+        self.fetched_at = time.time() if fetched_at is None else fetched_at
+        self._codes = {app.app_code.lower(): i for i, app in enumerate(self.apps)}
+        if titles is None or trigram_index is None:
+            titles = [_normalize(app.title) for app in self.apps]
+            trigram_index = {}
+            for i, title in enumerate(titles):
+                for trigram in _trigrams(title):
+                    trigram_index.setdefault(trigram, []).append(i)
+        self._titles = titles
+        self._trigram_index = trigram_index
+
+    @classmethod
+    def _fingerprint(cls, app_dicts: List[Dict]) -> str:
+        return hashlib.sha256(
+            json.dumps(app_dicts, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    @property
+    def is_stale(self) -> bool:
+        return time.time() - self.fetched_at > self.MAX_AGE
+
+    @classmethod
+    def _read(cls, path: Path) -> Optional[Dict]:
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    @classmethod
+    def load(cls, path: Optional[Path] = None) -> Optional["AppIndex"]:
+        """Load the stored index without fetching, None if there is none."""
+        data = cls._read(cls.DEFAULT_PATH if path is None else path)
+        try:
+            return cls(
+                [AppEntry(**app_dict) for app_dict in data["apps"]],
+                data["titles"],
+                data["trigram_index"],
+                data["fetched_at"],
+            )
+        except (TypeError, KeyError):
+            return None
+
+    @classmethod
+    def load_or_build(
+        cls, apps: Sequence[AppEntry], path: Optional[Path] = None
+    ) -> "AppIndex":
+        """Load the index stored for the same apps, or build a new one.
+
+        Either way, the apps are stored as freshly fetched.
+        """
+        path = cls.DEFAULT_PATH if path is None else path
+        app_dicts = [dataclasses.asdict(app) for app in apps]
+        fingerprint = cls._fingerprint(app_dicts)
+        data = cls._read(path)
+        try:
+            if data["fingerprint"] != fingerprint:
+                raise KeyError("fingerprint")
+            index = cls(apps, data["titles"], data["trigram_index"])
+        except (TypeError, KeyError):
+            index = cls(apps)
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(
+                {
+                    "fingerprint": fingerprint,
+                    "fetched_at": index.fetched_at,
+                    "apps": app_dicts,
+                    "titles": index._titles,
+                    "trigram_index": index._trigram_index,
+                },
+                file,
+            )
+        os.replace(tmp_path, path)
+        return index
+
+    def _score(self, i: int, query: str) -> float:
+        title = self._titles[i]
+        if not title:
+            return 0.0
+        closeness = min(len(query) / len(title), 1.0)
+        if query in title:
+            return _SCORE_SUBSTRING + closeness
+        if _is_subsequence(query, title):
+            return _SCORE_SUBSEQUENCE + closeness
+        query_trigrams = _trigrams(query)
+        if not query_trigrams:
+            return 0.0
+        overlap = len(query_trigrams & _trigrams(title)) / len(query_trigrams)
+        return overlap if overlap >= _MIN_TRIGRAM_OVERLAP else 0.0
+
+    def search(self, app_name: str, k: int = 5) -> List[Tuple[float, AppEntry]]:
+        """Return up to k (score, app) matches of app_name, best first."""
+        code = app_name.lower()
+        if code in self._codes:
+            return [(_SCORE_CODE, self.apps[self._codes[code]])]
+
+        query = _normalize(app_name)
+        if not query:
+            return []
+        query_trigrams = _trigrams(query)
+        hits: Counter = Counter()
+        for trigram in query_trigrams:
+            hits.update(self._trigram_index.get(trigram, ()))
+        # A title containing the query has all of its trigrams, so check those first.
+        scored = [
+            (self._score(i, query), i)
+            for (i, count) in hits.items()
+            if count == len(query_trigrams)
+        ]
+        if not any(score >= _SCORE_SUBSTRING for (score, _) in scored):
+            # Subsequences such as initials may not share trigrams, score all the apps.
+            scored = [(self._score(i, query), i) for i in range(len(self.apps))]
+        # Ties keep the order of the app list.
+        scored = sorted(
+            ((score, i) for (score, i) in scored if score > 0),
+            key=lambda entry: (-entry[0], entry[1]),
+        )
+        return [(score, self.apps[i]) for (score, i) in scored[:k]]
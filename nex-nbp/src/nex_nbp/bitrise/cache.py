@@ -0,0 +1,155 @@
+import json
+from pathlib import Path
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from nexcli.common import persistance_dir
+
+
+class BuildCache:
+    """Persistent cache of Bitrise build metadata, keyed by (app_slug, build_slug).
+
+    Metadata of finished builds never changes, so those entries never expire.
+    Entries of builds that are still running expire after IN_PROGRESS_TTL seconds.
+    Scans of the post builds of an app record the range of build numbers they listed
+    without gaps, only that range is complete in the cache.
+    """
+
+    DEFAULT_PATH = persistance_dir / "bitrise_cache.sqlite3"
+    IN_PROGRESS_TTL = 60.0
+    _TABLES = ("builds", "artifacts", "env_vars", "scanned_builds")
+
+    def __init__(self, path: Optional[Path] = None):
+        path = self.DEFAULT_PATH if path is None else path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # The client looks up the cache from its worker threads as well.
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(path), check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS builds ("
+                "app_slug TEXT, build_slug TEXT, build_number INTEGER, data TEXT, "
+                "finished INTEGER, updated_at REAL, "
+                "PRIMARY KEY (app_slug, build_slug))"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS builds_by_number "
+                "ON builds (app_slug, build_number)"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS scanned_builds ("
+                "app_slug TEXT PRIMARY KEY, low INTEGER, high INTEGER)"
+            )
+            for table in ("artifacts", "env_vars"):
+                self._connection.execute(
+                    f"CREATE TABLE IF NOT EXISTS {table} ("
+                    "app_slug TEXT, build_slug TEXT, data TEXT, "
+                    "finished INTEGER, updated_at REAL, "
+                    "PRIMARY KEY (app_slug, build_slug))"
+                )
+
+    @classmethod
+    def is_finished(cls, build: Dict) -> bool:
+        # Status 0 means the build is not finished yet.
+        return build.get("status", 0) != 0
+
+    def _is_fresh(self, finished: int, updated_at: float) -> bool:
+        return bool(finished) or time.time() - updated_at < self.IN_PROGRESS_TTL
+
+    def _get(self, table: str, app_slug: str, build_slug: str) -> Optional[Any]:
+        with self._lock:
+            row = self._connection.execute(
+                f"SELECT data, finished, updated_at FROM {table} "
+                "WHERE app_slug = ? AND build_slug = ?",
+                (app_slug, build_slug),
+            ).fetchone()
+        if row is None or not self._is_fresh(row[1], row[2]):
+            return None
+        return json.loads(row[0])
+
+    def _put(
+        self, table: str, app_slug: str, build_slug: str, data: Any, finished: bool
+    ) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                f"INSERT OR REPLACE INTO {table} "
+                "(app_slug, build_slug, data, finished, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (app_slug, build_slug, json.dumps(data), int(finished), time.time()),
+            )
+
+    def get_scanned_range(self, app_slug: str) -> Optional[Tuple[int, int]]:
+        """The (low, high) build numbers that post builds of the app were listed for.
+
+        Every post build in the range is cached. low is 0 once the listing reached the
+        oldest build.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT low, high FROM scanned_builds WHERE app_slug = ?",
+                (app_slug,),
+            ).fetchone()
+        return None if row is None else (row[0], row[1])
+
+    def put_scanned_range(self, app_slug: str, low: int, high: int) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO scanned_builds (app_slug, low, high) "
+                "VALUES (?, ?, ?)",
+                (app_slug, low, high),
+            )
+
+    def get_builds(
+        self, app_slug: str, min_build_number: int, max_build_number: int
+    ) -> List[Tuple[Dict, bool]]:
+        """List (build, is_fresh) of cached post builds in the range, latest first."""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT data, finished, updated_at FROM builds "
+                "WHERE app_slug = ? AND build_number BETWEEN ? AND ? "
+                "ORDER BY build_number DESC",
+                (app_slug, min_build_number, max_build_number),
+            ).fetchall()
+        return [
+            (json.loads(data), self._is_fresh(finished, updated_at))
+            for (data, finished, updated_at) in rows
+        ]
+
+    def put_build(self, app_slug: str, build: Dict) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO builds "
+                "(app_slug, build_slug, build_number, data, finished, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    app_slug,
+                    build["slug"],
+                    build["build_number"],
+                    json.dumps(build),
+                    int(self.is_finished(build)),
+                    time.time(),
+                ),
+            )
+
+    def get_artifacts(self, app_slug: str, build_slug: str) -> Optional[List[Dict]]:
+        return self._get("artifacts", app_slug, build_slug)
+
+    def put_artifacts(
+        self, app_slug: str, build_slug: str, artifacts: List[Dict], finished: bool
+    ) -> None:
+        self._put("artifacts", app_slug, build_slug, artifacts, finished)
+
+    def get_env_vars(self, app_slug: str, build_slug: str) -> Optional[Dict]:
+        return self._get("env_vars", app_slug, build_slug)
+
+    def put_env_vars(
+        self, app_slug: str, build_slug: str, env_vars: Dict, finished: bool
+    ) -> None:
+        self._put("env_vars", app_slug, build_slug, env_vars, finished)
+
+    def clear(self) -> None:
+        with self._lock, self._connection:
+            for table in self._TABLES:
+                self._connection.execute(f"DELETE FROM {table}")
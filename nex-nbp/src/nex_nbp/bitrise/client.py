@@ -1,38 +1,94 @@
 import click
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from itertools import islice
 import os.path
-from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+from typing import Deque, Dict, Iterator, List, Optional, Sequence, Tuple
 import requests
-from tqdm import tqdm
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+from ..download import DEFAULT_CHUNK_SIZE, DownloadJob, download_file
+from .cache import BuildCache
 from .utils import get_bitrise_api_key, get_bitrise_org_slug
 
 
 class Client:
-    def __init__(self, api_key: Optional[str] = None, org_slug: Optional[str] = None):
+    POOL_SIZE = 16
+    MAX_RETRIES = 3
+    RETRY_BACKOFF_FACTOR = 0.5
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    # The largest page size the API allows.
+    PAGE_SIZE = 50
+    API_URL = "https://api.bitrise.io/v0.1"
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        org_slug: Optional[str] = None,
+        cache: Optional[BuildCache] = None,
+        api_url: Optional[str] = None,
+    ):
         self._api_key = api_key if api_key is not None else get_bitrise_api_key()
         self._org_slug = org_slug if org_slug is not None else get_bitrise_org_slug()
+        self._api_url = api_url if api_url is not None else self.API_URL
+        self._session = self._create_session()
+        self._cache = cache
 
-    @classmethod
-    def _get_api_endpoint(cls, path: str) -> str:
-        return f"https://api.bitrise.io/v0.1/{path}"
+    @property
+    def cache(self) -> BuildCache:
+        if self._cache is None:
+            self._cache = BuildCache()
+        return self._cache
 
     @classmethod
-    def _get_apps_endpoint(cls, path: str) -> str:
-        return cls._get_api_endpoint(f"apps/{path}")
+    def _create_session(cls) -> requests.Session:
+        """Create a session that keeps connections alive across calls."""
+        # Only idempotent methods are retried, so that builds are never triggered twice.
+        retry = Retry(
+            total=cls.MAX_RETRIES,
+            backoff_factor=cls.RETRY_BACKOFF_FACTOR,
+            status_forcelist=cls.RETRY_STATUSES,
+            allowed_methods=("GET", "HEAD", "PATCH", "PUT", "DELETE"),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=cls.POOL_SIZE,
+            pool_maxsize=cls.POOL_SIZE,
+            max_retries=retry,
+        )
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
 
-    @classmethod
-    def _get_app_endpoint(cls, app_slug: str, path: str) -> str:
-        return cls._get_apps_endpoint(f"{app_slug}/{path}")
+    def close(self) -> None:
+        self._session.close()
 
-    @classmethod
-    def _get_builds_endpoint(cls, app_slug: str, build_slug: str, path: str) -> str:
-        return cls._get_apps_endpoint(f"{app_slug}/builds/{build_slug}/{path}")
+    def __enter__(self) -> "Client":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _get_api_endpoint(self, path: str) -> str:
+        return f"{self._api_url}/{path}"
+
+    def _get_apps_endpoint(self, path: str) -> str:
+        return self._get_api_endpoint(f"apps/{path}")
+
+    def _get_app_endpoint(self, app_slug: str, path: str) -> str:
+        return self._get_apps_endpoint(f"{app_slug}/{path}")
+
+    def _get_builds_endpoint(self, app_slug: str, build_slug: str, path: str) -> str:
+        return self._get_apps_endpoint(f"{app_slug}/builds/{build_slug}/{path}")
 
-    @classmethod
     def _get_artifact_endpoint(
-        cls, app_slug: str, build_slug: str, artifact_slug: str
+        self, app_slug: str, build_slug: str, artifact_slug: str
     ) -> str:
-        return cls._get_apps_endpoint(
+        return self._get_apps_endpoint(
             f"{app_slug}/builds/{build_slug}/artifacts/{artifact_slug}"
         )
 
@@ -43,28 +99,46 @@ class Client:
         }
         return headers
 
-    def get_apps(self) -> List[Dict]:
-        response = requests.request(
-            url=self._get_api_endpoint(f"apps"),
+    def _fetch_page(self, url: str, params: Dict) -> Dict:
+        response = self._session.request(
+            url=url,
             method="GET",
             headers=self._get_request_headers(),
-            params={"limit": 50},
+            params=params,
         )
         response.raise_for_status()
-        json = response.json()
-        all_apps = [app for app in json["data"]]
-        while "next" in json["paging"]:
-            response = requests.request(
-                url=self._get_api_endpoint(f"apps"),
-                method="GET",
-                headers=self._get_request_headers(),
-                params={"limit": 50, "next": json["paging"]["next"]},
-            )
-            response.raise_for_status()
-            json = response.json()
-            all_apps.extend(app for app in json["data"])
+        return response.json()
+
+    def _paginate(self, url: str, params: Optional[Dict] = None) -> Iterator[Dict]:
+        """Iterate the items of every page of a listing endpoint.
+
+        The next page is requested while the caller consumes the current one. Closing
+        the iterator early cancels the pending request for the next page.
+        """
+        params = {"limit": self.PAGE_SIZE, **(params or {})}
+        executor = ThreadPoolExecutor(max_workers=1)
+        page: Optional[Future] = executor.submit(self._fetch_page, url, params)
+        try:
+            while page is not None:
+                json = page.result()
+                next_token = json["paging"].get("next")
+                page = None
+                if next_token:
+                    page = executor.submit(
+                        self._fetch_page, url, {**params, "next": next_token}
+                    )
+                yield from json["data"]
+        finally:
+            if page is not None:
+                page.cancel()
+            executor.shutdown(wait=False)
+
+    def get_apps(self) -> List[Dict]:
+        return list(self.iter_apps())
 
-        return all_apps
+    def iter_apps(self) -> Iterator[Dict]:
+        """Iterate the apps page by page. Close the iterator if it is not exhausted."""
+        return self._paginate(self._get_api_endpoint("apps"))
 
     def build(
         self, app_slug: str, workflow_id: str, git_branch: str, clean: bool = False
@@ -78,7 +152,7 @@ class Client:
                     "is_expand": False,
                 }
             ]
-        response = requests.request(
+        response = self._session.request(
             url=self._get_app_endpoint(app_slug, "builds"),
             method="POST",
             headers=self._get_request_headers(),
@@ -89,40 +163,113 @@ class Client:
         )
         return (response.status_code, response.reason, response.json())
 
-    def _get_post_builds(self, app_slug: str) -> Iterator[Dict]:
-        response = requests.request(
+    def _list_post_builds(
+        self, app_slug: str, before: Optional[int] = None
+    ) -> Iterator[Dict]:
+        """List post builds from the latest, triggered before a timestamp if given."""
+        params = dict(workflow="ucb_post_build")
+        if before is not None:
+            params["before"] = before
+        return self._paginate(self._get_app_endpoint(app_slug, "builds"), params)
+
+    def list_builds(self, app_slug: str, **filters) -> List[Dict]:
+        """List the latest builds matching filters, such as build_number or status."""
+        response = self._session.request(
             url=self._get_app_endpoint(app_slug, "builds"),
             method="GET",
             headers=self._get_request_headers(),
-            params=dict(workflow="ucb_post_build"),
+            params=filters,
         )
         response.raise_for_status()
-        json = response.json()
-        for data in json["data"]:
-            yield data
-        while "next" in json["paging"]:
-            response = requests.request(
-                url=self._get_app_endpoint(app_slug, "builds"),
-                method="GET",
-                headers=self._get_request_headers(),
-                params=dict(workflow="ucb_post_build", next=json["paging"]["next"]),
-            )
-            response.raise_for_status()
-            json = response.json()
-            for data in json["data"]:
-                yield data
+        return response.json()["data"]
 
-    def _fetch_artifacts(self, app_slug: str, build_slug: str) -> Tuple[Dict, Dict]:
-        response = requests.request(
-            url=self._get_builds_endpoint(app_slug, build_slug, "artifacts"),
+    def fetch_build(self, app_slug: str, build_slug: str) -> Dict:
+        response = self._session.request(
+            url=self._get_app_endpoint(app_slug, f"builds/{build_slug}"),
             method="GET",
             headers=self._get_request_headers(),
         )
         response.raise_for_status()
+        return response.json()["data"]
+
+    def _get_post_builds(self, app_slug: str) -> Iterator[Dict]:
+        """Iterate post builds from the latest, listing unscanned ones from the API.
+
+        Only the range of build numbers that earlier scans listed without gaps is read
+        from the cache. This scan's range replaces it once the two join.
+        """
+        scanned = self.cache.get_scanned_range(app_slug)
+        # The range of build numbers listed so far, from the latest build down.
+        (low, high) = (None, None)
+        joined = scanned is None
+        try:
+            listed = self._list_post_builds(app_slug)
+            for build in listed:
+                build_number = build["build_number"]
+                if not joined and build_number <= scanned[1]:
+                    listed.close()
+                    break
+                self.cache.put_build(app_slug, build)
+                if high is None:
+                    high = build_number
+                low = build_number
+                yield build
+            else:
+                joined = True
+                low = 0
+                return
+
+            # The rest of the scanned range is cached.
+            joined = True
+            if high is None:
+                high = scanned[1]
+            low = scanned[0]
+            oldest = None
+            for build, is_fresh in self.cache.get_builds(app_slug, low, scanned[1]):
+                if not is_fresh:
+                    build = self.fetch_build(app_slug, build["slug"])
+                    self.cache.put_build(app_slug, build)
+                oldest = build
+                yield build
+            if low == 0 or oldest is None:
+                return
+
+            # Older builds were never listed. They are listed from the oldest cached
+            # build on, rather than paging through all the newer builds again.
+            triggered_at = datetime.fromisoformat(
+                oldest["triggered_at"].replace("Z", "+00:00")
+            )
+            # The timestamp is rounded up, builds triggered in the same second as the
+            # oldest one are skipped by their number instead.
+            before = int(triggered_at.timestamp()) + 1
+            for build in self._list_post_builds(app_slug, before):
+                if build["build_number"] >= low:
+                    continue
+                self.cache.put_build(app_slug, build)
+                low = build["build_number"]
+                yield build
+            low = 0
+        finally:
+            if joined and high is not None:
+                self.cache.put_scanned_range(app_slug, low, high)
+
+    def _fetch_artifacts(
+        self, app_slug: str, build_slug: str, finished: bool = False
+    ) -> Tuple[Dict, Dict]:
+        artifacts = self.cache.get_artifacts(app_slug, build_slug)
+        if artifacts is None:
+            response = self._session.request(
+                url=self._get_builds_endpoint(app_slug, build_slug, "artifacts"),
+                method="GET",
+                headers=self._get_request_headers(),
+            )
+            response.raise_for_status()
+            artifacts = response.json()["data"]
+            self.cache.put_artifacts(app_slug, build_slug, artifacts, finished)
         # Find the artifacts with the name env_vars.json, and one with with the .apk suffix
         apk_artifact = None
         env_artifact = None
-        for artifact in response.json()["data"]:
+        for artifact in artifacts:
             if artifact["title"] == "env_vars.json":
                 env_artifact = artifact
             elif artifact["artifact_type"] == "android-apk":
@@ -132,7 +279,7 @@ class Client:
     def _get_download_url(
         self, app_slug: str, build_slug: str, artifact_slug: str
     ) -> str:
-        response = requests.request(
+        response = self._session.request(
             url=self._get_artifact_endpoint(app_slug, build_slug, artifact_slug),
             method="GET",
             headers=self._get_request_headers(),
@@ -141,50 +288,98 @@ class Client:
         return response.json()["data"]["expiring_download_url"]
 
     def _fetch_env_vars(
-        self, app_slug: str, build_slug: str, env_artifact: Dict
+        self, app_slug: str, build_slug: str, env_artifact: Dict, finished: bool = False
     ) -> Dict:
+        env_vars = self.cache.get_env_vars(app_slug, build_slug)
+        if env_vars is not None:
+            return env_vars
         download_url = self._get_download_url(
             app_slug, build_slug, env_artifact["slug"]
         )
-        downloaded = requests.request(url=download_url, method="GET")
+        downloaded = self._session.request(url=download_url, method="GET")
         downloaded.raise_for_status()
-        return downloaded.json()
+        env_vars = downloaded.json()
+        self.cache.put_env_vars(app_slug, build_slug, env_vars, finished)
+        return env_vars
+
+    def _fetch_post_build(
+        self, app_slug: str, build: Dict
+    ) -> Optional[Tuple[Dict, Dict, Dict]]:
+        """Fetch (build, apk_artifact, env_vars) of a post build, if it has both artifacts."""
+        build_slug = build["slug"]
+        finished = BuildCache.is_finished(build)
+        env_artifact, apk_artifact = self._fetch_artifacts(
+            app_slug, build_slug, finished
+        )
+        if env_artifact is None or apk_artifact is None:
+            return None
+        env_vars = self._fetch_env_vars(app_slug, build_slug, env_artifact, finished)
+        return (build, apk_artifact, env_vars)
 
     def get_post_builds(
-        self, app_slug: str, git_branch: Optional[str], workflows: List[str]
+        self,
+        app_slug: str,
+        git_branch: Optional[str],
+        workflows: List[str],
+        max_workers: int = 8,
     ) -> Dict[str, Tuple[Dict, Dict]]:
         ret = {}
         if not workflows:
             return ret
         valid_workflows = set(workflows)
         num_remaining = len(valid_workflows)
-        for build in self._get_post_builds(app_slug):
-            build_slug = build["slug"]
-            env_artifact, apk_artifact = self._fetch_artifacts(app_slug, build_slug)
-            if env_artifact is None or apk_artifact is None:
-                continue
-            env_vars = self._fetch_env_vars(app_slug, build_slug, env_artifact)
-            workflow_id = env_vars["TRIGGER_STAGE_BITRISE_TRIGGERED_WORKFLOW_ID"]
-            if workflow_id not in valid_workflows:
-                continue
-            if workflow_id in ret:
-                continue
-            if (
-                git_branch is not None
-                and env_vars["TRIGGER_STAGE_BITRISE_GIT_BRANCH"] != git_branch
-            ):
-                continue
-            ret[workflow_id] = (build, apk_artifact)
-            num_remaining -= 1
-            if num_remaining == 0:
-                break
+        # Artifacts of upcoming builds are fetched ahead, while the builds are still
+        # evaluated in order, so that the latest build of each workflow wins.
+        prefetch = 2 * max_workers
+        builds = self._get_post_builds(app_slug)
+        pending: Deque[Future] = deque()
+        with ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="bitrise"
+        ) as executor:
+            try:
+                while num_remaining > 0:
+                    for build in islice(builds, prefetch - len(pending)):
+                        pending.append(
+                            executor.submit(self._fetch_post_build, app_slug, build)
+                        )
+                    if not pending:
+                        break
+                    post_build = pending.popleft().result()
+                    if post_build is None:
+                        continue
+                    (build, apk_artifact, env_vars) = post_build
+                    workflow_id = env_vars[
+                        "TRIGGER_STAGE_BITRISE_TRIGGERED_WORKFLOW_ID"
+                    ]
+                    if workflow_id not in valid_workflows:
+                        continue
+                    if workflow_id in ret:
+                        continue
+                    if (
+                        git_branch is not None
+                        and env_vars["TRIGGER_STAGE_BITRISE_GIT_BRANCH"] != git_branch
+                    ):
+                        continue
+                    ret[workflow_id] = (build, apk_artifact)
+                    num_remaining -= 1
+            finally:
+                # Stop early, dropping the work that has not started yet.
+                for future in pending:
+                    future.cancel()
+                builds.close()
 
         return ret
 
     def download_artifact(
-        self, app_slug: str, build_slug: str, artifact_slug: str, out_dir: str
+        self,
+        app_slug: str,
+        build_slug: str,
+        artifact_slug: str,
+        out_dir: str,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        segments: int = 1,
     ) -> None:
-        response = requests.request(
+        response = self._session.request(
             url=self._get_artifact_endpoint(app_slug, build_slug, artifact_slug),
             method="GET",
             headers=self._get_request_headers(),
@@ -197,17 +392,26 @@ class Client:
         output_file = os.path.join(out_dir, metadata["title"])
         click.echo(f"Downloading to {output_file}")
         click.echo(f"Download URL: {download_url}")
-        with requests.get(download_url, stream=True) as req:
-            req.raise_for_status()
-            with open(output_file, "wb") as file:
-                with tqdm(total=file_size_bytes, unit="b", unit_scale=True) as pbar:
-                    for chunk in req.iter_content(chunk_size=8192):
-                        if chunk:
-                            file.write(chunk)
-                            pbar.update(len(chunk))
+        download_file(
+            self._session,
+            DownloadJob(
+                download_url,
+                output_file,
+                file_size_bytes,
+                f"{app_slug}/{build_slug}/{artifact_slug}",
+            ),
+            chunk_size,
+            segments=segments,
+        )
 
     def download_apk(
-        self, app_slug: str, build: Dict, apk_artifact: Dict, out_dir: str
+        self,
+        app_slug: str,
+        build: Dict,
+        apk_artifact: Dict,
+        out_dir: str,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        segments: int = 1,
     ) -> None:
         build_slug = build["slug"]
         artifact_slug = apk_artifact["slug"]
@@ -216,11 +420,14 @@ class Client:
         output_file = os.path.join(out_dir, apk_artifact["title"])
         click.echo(f"Downloading to {output_file}")
         click.echo(f"Download URL: {download_url}")
-        with requests.get(download_url, stream=True) as req:
-            req.raise_for_status()
-            with open(output_file, "wb") as file:
-                with tqdm(total=file_size_bytes, unit="b", unit_scale=True) as pbar:
-                    for chunk in req.iter_content(chunk_size=8192):
-                        if chunk:
-                            file.write(chunk)
-                            pbar.update(len(chunk))
+        download_file(
+            self._session,
+            DownloadJob(
+                download_url,
+                output_file,
+                file_size_bytes,
+                f"{app_slug}/{build_slug}/{artifact_slug}",
+            ),
+            chunk_size,
+            segments=segments,
+        )
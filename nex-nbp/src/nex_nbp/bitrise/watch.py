@@ -0,0 +1,144 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+import threading
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+import click
+import requests
+
+from .client import Client
+
+MIN_POLL_INTERVAL = 5.0
+MAX_POLL_INTERVAL = 60.0
+POLL_BACKOFF = 1.5
+# A build is given up on after this many consecutive failed polls.
+MAX_POLL_ERRORS = 5
+
+_FINISHED_PHASES = {1: "success", 2: "failed", 3: "aborted", 4: "aborted"}
+
+
+class WatchedBuild(NamedTuple):
+    build_slug: str
+    build_number: int
+    workflow: str
+
+
+def _parse_time(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def _format_duration(start: Optional[datetime], end: Optional[datetime]) -> str:
+    if start is None or end is None:
+        return "?"
+    return str(timedelta(seconds=round((end - start).total_seconds())))
+
+
+def get_build_phase(build: Dict) -> str:
+    status = build.get("status", 0)
+    if status != 0:
+        return _FINISHED_PHASES.get(status, build.get("status_text", "finished"))
+    if build.get("is_on_hold"):
+        return "on-hold"
+    if build.get("started_on_worker_at") is None:
+        return "queued"
+    return "running"
+
+
+class BuildWatcher:
+    """Polls a set of builds concurrently until all of them finish.
+
+    Every build is polled on its own thread over the client's shared session. The poll
+    interval of a build grows while its phase stays the same and resets on a change.
+    """
+
+    def __init__(
+        self,
+        client: Client,
+        app_slug: str,
+        min_interval: float = MIN_POLL_INTERVAL,
+        max_interval: float = MAX_POLL_INTERVAL,
+    ):
+        self._client = client
+        self._app_slug = app_slug
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._stop = threading.Event()
+        self._echo_lock = threading.Lock()
+
+    def _echo(self, watched: WatchedBuild, message: str, err: bool = False) -> None:
+        with self._echo_lock:
+            click.echo(
+                f"#{watched.build_number} {watched.workflow}: {message}", err=err
+            )
+
+    def _watch(self, watched: WatchedBuild) -> str:
+        """Poll one build until it finishes, returning its final phase."""
+        phase: Optional[str] = None
+        interval = self._min_interval
+        num_errors = 0
+        while not self._stop.is_set():
+            try:
+                build = self._client.fetch_build(self._app_slug, watched.build_slug)
+                num_errors = 0
+            except requests.RequestException as ex:
+                num_errors += 1
+                if num_errors == MAX_POLL_ERRORS:
+                    self._echo(watched, f"giving up, {ex}", err=True)
+                    return "unknown"
+                interval = min(interval * POLL_BACKOFF, self._max_interval)
+                self._stop.wait(interval)
+                continue
+
+            new_phase = get_build_phase(build)
+            if new_phase != phase:
+                now = datetime.now().astimezone()
+                triggered_at = _parse_time(build.get("triggered_at"))
+                started_at = _parse_time(build.get("started_on_worker_at"))
+                if new_phase == "running":
+                    queued_for = _format_duration(triggered_at, started_at)
+                    self._echo(watched, f"running, queued for {queued_for}")
+                elif new_phase in _FINISHED_PHASES.values():
+                    finished_at = _parse_time(build.get("finished_at")) or now
+                    self._echo(
+                        watched,
+                        f"{new_phase} in {_format_duration(started_at, finished_at)}, "
+                        f"{_format_duration(triggered_at, finished_at)} in total",
+                    )
+                else:
+                    self._echo(watched, new_phase)
+                phase = new_phase
+                interval = self._min_interval
+            else:
+                interval = min(interval * POLL_BACKOFF, self._max_interval)
+            if build.get("status", 0) != 0:
+                return phase
+            self._stop.wait(interval)
+        return "unknown"
+
+    def watch(self, builds: Sequence[WatchedBuild]) -> List[str]:
+        """Watch builds until all of them finish. Returns the final phase of each."""
+        if not builds:
+            return []
+        with ThreadPoolExecutor(max_workers=len(builds)) as executor:
+            futures = [executor.submit(self._watch, watched) for watched in builds]
+            try:
+                # Waiting with a timeout keeps the main thread responsive to Ctrl-C.
+                while wait(futures, timeout=1.0).not_done:
+                    pass
+            except KeyboardInterrupt:
+                self._stop.set()
+                raise
+            return [future.result() for future in futures]
+
+
+def watch_builds(client: Client, app_slug: str, builds: Sequence[WatchedBuild]) -> None:
+    """Watch builds until they finish, failing unless all of them succeed."""
+    phases = BuildWatcher(client, app_slug).watch(builds)
+    num_failed = sum(phase != "success" for phase in phases)
+    if num_failed:
+        raise click.ClickException(
+            f"{num_failed} of {len(builds)} builds did not succeed."
+        )
+    click.echo(f"All {len(builds)} builds succeeded.")
@@ -0,0 +1,85 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
+
+import click
+
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_MAX_WORKERS = 8
+
+ClientT = TypeVar("ClientT")
+
+
+class BatchResult(NamedTuple):
+    app_code: str
+    build_nums: Sequence[int]
+    error: Optional[Exception]
+
+
+def parse_build_selectors(lines: Iterable[str]) -> List[Tuple[Optional[str], int]]:
+    """Parse lines of `[APP] BUILD_NUM...` into (app name, build number) pairs.
+
+    The app is None for lines that only have build numbers. Blank lines and text after
+    `#` are ignored.
+    """
+    selectors: List[Tuple[Optional[str], int]] = []
+    for line_num, line in enumerate(lines, 1):
+        words = line.split("#", 1)[0].split()
+        if not words:
+            continue
+        app_name: Optional[str] = None
+        if not words[0].isdigit():
+            app_name = words.pop(0)
+        if not words:
+            raise click.BadParameter(f"Line {line_num} has no build numbers: {line!r}")
+        for word in words:
+            if not word.isdigit():
+                raise click.BadParameter(
+                    f"Line {line_num} has an invalid build number: {word!r}"
+                )
+            selectors.append((app_name, int(word)))
+    return selectors
+
+
+def run_batches(
+    builds_by_app: Dict[str, Sequence[int]],
+    create_client: Callable[[], ClientT],
+    update: Callable[[ClientT, str, Sequence[int]], None],
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> List[BatchResult]:
+    """Call update(client, app_code, build_nums) for batches of builds concurrently.
+
+    Clients are not shared across threads, every worker creates one of its own with
+    create_client. Returns the result of every batch, in submission order.
+    """
+    batches = [
+        (app_code, build_nums[start : start + batch_size])
+        for app_code, build_nums in builds_by_app.items()
+        for start in range(0, len(build_nums), batch_size)
+    ]
+
+    local = threading.local()
+
+    def run(batch: Tuple[str, Sequence[int]]) -> BatchResult:
+        (app_code, build_nums) = batch
+        try:
+            if not hasattr(local, "client"):
+                local.client = create_client()
+            update(local.client, app_code, build_nums)
+            return BatchResult(app_code, build_nums, None)
+        except Exception as ex:
+            return BatchResult(app_code, build_nums, ex)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(run, batches))
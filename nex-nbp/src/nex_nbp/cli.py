@@ -1,30 +1,54 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import os.path
 from functools import cached_property
-from typing import Dict, List, Optional, Sequence
+from itertools import chain
+import threading
+from typing import Dict, List, Optional, Sequence, TextIO, Tuple
 
 import click
 from tabulate import tabulate
 from nex_bitrise_index import Client as BitriseIndexClient
 from nex_bitrise_index.interface import AppEntry, BuildEntry
 import requests
-from tqdm import tqdm
+from requests.adapters import HTTPAdapter
 
+from .apk_store import ApkKey, ApkStore
+from .app_index import AppIndex
 from .bitrise import BitriseClient
+from .bitrise.watch import WatchedBuild, watch_builds
+from .bulk import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_MAX_WORKERS,
+    BatchResult,
+    parse_build_selectors,
+    run_batches,
+)
+from .download import DEFAULT_CHUNK_SIZE, DownloadJob, download_files
 from .git import GitInfo
 
 
 class NBPCommandContext:
     def __init__(self):
-        self.git_info = GitInfo.create()
         self.bitrise_index_client = BitriseIndexClient()
         self._app_name: Optional[str] = None
+        self._refresh_apps = False
+        self._app_index_fetched = False
+        self._app_index_refresh: Optional[threading.Thread] = None
+        self._refreshed_app_index: Optional[AppIndex] = None
         self._branch: Optional[str] = None
         self._workflows: List[str] = []
 
+    @cached_property
+    def git_info(self) -> Optional[GitInfo]:
+        return GitInfo.create()
+
     def set_app_name(self, app_name: Optional[str]) -> None:
         self._app_name = app_name
 
+    def set_refresh_apps(self, refresh_apps: bool) -> None:
+        self._refresh_apps = refresh_apps
+
     @classmethod
     def _find_app_entry_by_git(
         cls, apps: List[AppEntry], git_info: GitInfo
@@ -37,42 +61,31 @@ class NBPCommandContext:
 
     @classmethod
     def _find_app_entry_by_app_name(
-        cls, apps: List[AppEntry], app_name: str
+        cls, app_index: AppIndex, app_name: str
     ) -> Optional[AppEntry]:
-        app_name = app_name.lower()
-        for app in apps:
-            if app.app_code.lower() == app_name:
-                return app
-
-        # We pick the app name that is most suitable.
-        for app in apps:
-            # Try to find a match.
-            if app.title.lower().find(app_name) != -1:
-                return app
-        # No match, try removing spaces.
-        app_name = app_name.replace(" ", "")
-        for app in apps:
-            if app.title.lower().replace(" ", "").find(app_name) != -1:
-                return app
-        # Still no match. Try to find one that has the same sequence.
-        for app in apps:
-            title = app.title.lower().replace(" ", "")
-            pos = -1
-            for ch in app_name:
-                pos = title.find(ch, pos + 1)
-                if pos == -1:
-                    break
-            else:
-                return app
-
-        return None
+        matches = app_index.search(app_name)
+        if not matches:
+            return None
+        # Matches in the same score tier as the best one are equally plausible.
+        (best_score, app_entry) = matches[0]
+        others = [app for (score, app) in matches[1:] if int(score) == int(best_score)]
+        if others:
+            click.echo(
+                f"{app_name} is ambiguous, also matching: "
+                + ", ".join(f"{app.app_code} ({app.title})" for app in others),
+                err=True,
+            )
+        return app_entry
 
     @classmethod
     def _find_app_entry(
-        cls, apps: List[AppEntry], git_info: Optional[GitInfo], app_name: Optional[str]
+        cls,
+        app_index: AppIndex,
+        git_info: Optional[GitInfo],
+        app_name: Optional[str],
     ) -> Optional[AppEntry]:
         if app_name is not None:
-            app_entry = cls._find_app_entry_by_app_name(apps, app_name)
+            app_entry = cls._find_app_entry_by_app_name(app_index, app_name)
             if app_entry is None:
                 raise click.UsageError(
                     f"Could not find app on bitrise matching {app_name}"
@@ -82,7 +95,11 @@ class NBPCommandContext:
                 raise click.UsageError(
                     "Please run inside a git repository to use auto app discovery."
                 )
-            app_entry = cls._find_app_entry_by_git(apps, git_info)
+            if git_info.remote_url is None:
+                raise click.UsageError(
+                    "Please add an origin remote to use auto app discovery."
+                )
+            app_entry = cls._find_app_entry_by_git(app_index.apps, git_info)
             if app_entry is None:
                 raise click.UsageError(
                     f"Could not find app on bitrise matching git url {git_info.remote_url}"
@@ -90,10 +107,108 @@ class NBPCommandContext:
         click.echo(f"Selected App: {app_entry.app_code}")
         return app_entry
 
+    def _fetch_app_index(self) -> AppIndex:
+        self._app_index_fetched = True
+        return AppIndex.load_or_build(self.bitrise_index_client.fetch_all_apps())
+
+    def _refresh_app_index(self) -> None:
+        try:
+            # A client of its own, the main thread keeps using the shared one.
+            self._refreshed_app_index = AppIndex.load_or_build(
+                BitriseIndexClient().fetch_all_apps()
+            )
+        except Exception:
+            pass  # Keep serving the stored apps, e.g. when offline.
+
+    @cached_property
+    def app_index(self) -> AppIndex:
+        """The stored app list, refreshed in the background when stale.
+
+        The apps are fetched in the foreground if there is no stored list yet or a
+        refresh is requested.
+        """
+        if not self._refresh_apps:
+            app_index = AppIndex.load()
+            if app_index is not None:
+                if app_index.is_stale:
+                    # Not a daemon, so the refreshed apps are stored before exiting.
+                    self._app_index_refresh = threading.Thread(
+                        target=self._refresh_app_index
+                    )
+                    self._app_index_refresh.start()
+                return app_index
+        return self._fetch_app_index()
+
+    def _update_app_index(self) -> bool:
+        """Replace the stored app list by a fetched one.
+
+        Returns False if the apps were already fetched, or the refresh failed.
+        """
+        if self._app_index_refresh is not None:
+            self._app_index_refresh.join()
+            self._app_index_refresh = None
+            if self._refreshed_app_index is None:
+                return False
+            self._app_index_fetched = True
+            self.app_index = self._refreshed_app_index
+            return True
+        if self._app_index_fetched:
+            return False
+        self.app_index = self._fetch_app_index()
+        return True
+
+    def find_stored_app_entry(self) -> Optional[AppEntry]:
+        """Find the app in the stored app list, without fetching or refreshing it.
+
+        Returns None if no app list is stored yet.
+        """
+        app_index = AppIndex.load()
+        if app_index is None:
+            return None
+        return self._find_app_entry(app_index, self.git_info, self._app_name)
+
     @cached_property
     def app_entry(self) -> AppEntry:
-        all_apps = self.bitrise_index_client.fetch_all_apps()
-        return self._find_app_entry(all_apps, self.git_info, self._app_name)
+        try:
+            return self._find_app_entry(self.app_index, self.git_info, self._app_name)
+        except click.UsageError:
+            if not self._update_app_index():
+                raise
+        return self._find_app_entry(self.app_index, self.git_info, self._app_name)
+
+    def group_builds_by_app(
+        self,
+        build_nums: Sequence[int],
+        selectors: Sequence[Tuple[Optional[str], int]] = (),
+    ) -> Dict[str, List[int]]:
+        """Group build numbers by app code, resolving the app name of each selector.
+
+        Build numbers without an app belong to the selected app.
+        """
+        builds_by_app: Dict[str, List[int]] = {}
+        app_codes: Dict[str, str] = {}
+        for app_name, build_num in chain(
+            ((None, build_num) for build_num in build_nums), selectors
+        ):
+            if app_name is None:
+                app_code = self.app_entry.app_code
+            elif app_name in app_codes:
+                app_code = app_codes[app_name]
+            else:
+                app_entry = self._find_app_entry_by_app_name(self.app_index, app_name)
+                if app_entry is None and self._update_app_index():
+                    app_entry = self._find_app_entry_by_app_name(
+                        self.app_index, app_name
+                    )
+                if app_entry is None:
+                    raise click.UsageError(
+                        f"Could not find app on bitrise matching {app_name}"
+                    )
+                app_code = app_codes[app_name] = app_entry.app_code
+            app_builds = builds_by_app.setdefault(app_code, [])
+            if build_num not in app_builds:
+                app_builds.append(build_num)
+        return builds_by_app
 
     def initialize_branch(
         self, branch: Optional[str], use_git_branch: bool = True
@@ -106,6 +221,10 @@ class NBPCommandContext:
                     "Auto git branch is only valid inside a git repo."
                 )
             self._branch = self.git_info.remote_name
+            if self._branch is None:
+                raise click.UsageError(
+                    "Auto git branch is not valid with a detached HEAD."
+                )
         else:
             self._branch = None
 
@@ -170,11 +289,17 @@ class NBPCommandContext:
 @click.option(
     "-a", "--app-name", "app_name", help="App name", type=click.STRING, default=None
 )
+@click.option(
+    "--refresh",
+    is_flag=True,
+    help="Fetch the app list from the index instead of using the stored one.",
+)
 @click.pass_context
-def nbp(ctx: click.Context, app_name: Optional[str]) -> None:
+def nbp(ctx: click.Context, app_name: Optional[str], refresh: bool) -> None:
     """Provide utilities of interacting with NBP projects."""
     ctx.ensure_object(NBPCommandContext)
     ctx.obj.set_app_name(app_name)
+    ctx.obj.set_refresh_apps(refresh)
 
 
 _staging_option = click.option(
@@ -211,6 +336,20 @@ _targets_option = click.option(
 @_production_option
 @_targets_option
 @click.option("-c", "--clean/--no-clean", "clean", is_flag=True, default=False)
+@click.option(
+    "-w",
+    "--watch",
+    is_flag=True,
+    help="Follow the triggered builds until they finish.",
+    default=False,
+)
+@click.option(
+    "-n",
+    "--dry-run",
+    is_flag=True,
+    help="Show the workflows that would be triggered, without triggering them.",
+    default=False,
+)
 @click.pass_context
 def trigger(
     ctx: click.Context,
@@ -219,26 +358,73 @@ def trigger(
     production: Optional[bool],
     targets: Sequence[str],
     clean: bool,
+    watch: bool,
+    dry_run: bool,
 ) -> None:
     """Trigger a build through bitrise."""
     context: NBPCommandContext = ctx.obj
-    app_entry = context.app_entry
     context.initialize_branch(branch)
     context.initialize_workflows(targets, staging, production)
+    workflows = context.workflows
+
+    if dry_run:
+        # Only the stored app list is used, a dry run makes no requests.
+        try:
+            if context.find_stored_app_entry() is None:
+                click.echo("No stored app list, the app is resolved when triggering.")
+        except click.UsageError as ex:
+            click.echo(f"App not found in the stored app list: {ex.message}", err=True)
+        click.echo(f"Branch: {context.branch}")
+        click.echo(f"Clean:  {clean}")
+        for workflow_id in workflows:
+            click.echo(f"Would trigger {workflow_id}")
+        return
 
-    bitrise_client = BitriseClient()
-    for workflow_id in context.workflows:
-        click.echo(f"Triggering {workflow_id} ... ", nl=False)
-        (status_code, reason, response) = bitrise_client.build(
-            app_entry.slug, workflow_id, context.branch, clean
-        )
-        if status_code != 201:
-            click.echo("FAILED")
-            click.echo(f"REASON: {reason}", err=True)
-            click.echo(f"RESPONSE: {response}", err=True)
-        else:
-            click.echo(f"SUCCESS: {response['build_number']}")
-            click.echo(f"    {response['build_url']}")
+    app_entry = context.app_entry
+    with BitriseClient() as bitrise_client:
+        # The triggers are independent, so they are all in flight at once.
+        with ThreadPoolExecutor(max_workers=len(workflows)) as executor:
+            futures = [
+                executor.submit(
+                    bitrise_client.build,
+                    app_entry.slug,
+                    workflow_id,
+                    context.branch,
+                    clean,
+                )
+                for workflow_id in workflows
+            ]
+        triggered: List[WatchedBuild] = []
+        failed: List[str] = []
+        for workflow_id, future in zip(workflows, futures):
+            click.echo(f"Triggering {workflow_id} ... ", nl=False)
+            try:
+                (status_code, reason, response) = future.result()
+            except Exception as ex:
+                click.echo("FAILED")
+                click.echo(f"ERROR: {ex}", err=True)
+                failed.append(workflow_id)
+                continue
+            if status_code != 201:
+                click.echo("FAILED")
+                click.echo(f"REASON: {reason}", err=True)
+                click.echo(f"RESPONSE: {response}", err=True)
+                failed.append(workflow_id)
+            else:
+                click.echo(f"SUCCESS: {response['build_number']}")
+                click.echo(f"    {response['build_url']}")
+                triggered.append(
+                    WatchedBuild(
+                        response["build_slug"], response["build_number"], workflow_id
+                    )
+                )
+        if watch and triggered:
+            watch_builds(bitrise_client, app_entry.slug, triggered)
+        if failed:
+            raise click.ClickException(
+                f"Failed to trigger {len(failed)} of {len(workflows)} workflows: "
+                + ", ".join(failed)
+            )
 
 
 @nbp.command("list")
@@ -246,9 +432,7 @@ def trigger(
 def list_projects(ctx: click.Context) -> None:
     """List configured NBP projects."""
     context: NBPCommandContext = ctx.obj
-    bitrise_index_client = context.bitrise_index_client
-    all_apps = bitrise_index_client.fetch_all_apps()
-    table = sorted([app.title, app.repo_url] for app in all_apps)
+    table = sorted([app.title, app.repo_url] for app in context.app_index.apps)
     headers = ["TITLE", "REPO-URL"]
     click.echo(tabulate(table, headers, tablefmt="simple"))
 
@@ -361,8 +545,42 @@ def build_details(ctx: click.Context, build_nums: Sequence[int]) -> None:
     help="Output directory for apks.",
     default=os.path.expanduser("~/Downloads/"),
 )
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    help="Maximum number of concurrent downloads.",
+    default=4,
+)
+@click.option(
+    "--chunk-size",
+    type=click.IntRange(min=8),
+    help="Download chunk size in KiB.",
+    default=DEFAULT_CHUNK_SIZE // 1024,
+)
+@click.option(
+    "-n",
+    "--segments",
+    type=click.IntRange(min=1),
+    help="Split each large apk into this many ranges, downloaded in parallel.",
+    default=1,
+)
+@click.option(
+    "--cache/--no-cache",
+    "use_cache",
+    default=True,
+    help="Reuse apks downloaded earlier from the local apk store.",
+)
 @click.pass_context
-def builds_apk(ctx: click.Context, build_nums: Sequence[int], output: str) -> None:
+def builds_apk(
+    ctx: click.Context,
+    build_nums: Sequence[int],
+    output: str,
+    jobs: int,
+    chunk_size: int,
+    segments: int,
+    use_cache: bool,
+) -> None:
     """Download apk for the give app / branch."""
     context: NBPCommandContext = ctx.obj
     app_entry = context.app_entry
@@ -386,24 +604,151 @@ def builds_apk(ctx: click.Context, build_nums: Sequence[int], output: str) -> No
             bitrise_index_client.fetch_builds(app_entry.app_code, list(set(build_nums)))
         )
 
+    apk_store = ApkStore() if use_cache else None
+    download_jobs: List[DownloadJob] = []
+    apk_keys: List[ApkKey] = []
     for build_entry in build_entries:
-        # We are going to download one artifact at a time.
         artifact_entry = bitrise_index_client.fetch_apk(
             app_entry.app_code, build_num=build_entry.build_num
         )
         output_file = os.path.join(output, artifact_entry.name)
+        apk_key = ApkKey(
+            app_entry.app_code,
+            build_entry.build_num,
+            artifact_entry.name,
+            artifact_entry.byte_size,
+        )
+        if apk_store is not None and apk_store.link_into(apk_key, output_file):
+            click.echo(f"Reused stored apk for {output_file}")
+            continue
         click.echo(f"Downloading to {output_file}")
         click.echo(f"Download URL: {artifact_entry.download_url}")
-        with requests.get(artifact_entry.download_url, stream=True) as response:
-            response.raise_for_status()
-            with open(output_file, "wb") as file:
-                with tqdm(
-                    total=artifact_entry.byte_size, unit="b", unit_scale=True
-                ) as pbar:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        if chunk:
-                            file.write(chunk)
-                            pbar.update(len(chunk))
+        download_jobs.append(
+            DownloadJob(
+                artifact_entry.download_url,
+                output_file,
+                artifact_entry.byte_size,
+                f"{app_entry.app_code}/{build_entry.build_num}/{artifact_entry.name}",
+            )
+        )
+        apk_keys.append(apk_key)
+
+    with requests.Session() as session:
+        adapter = HTTPAdapter(pool_maxsize=jobs * segments)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        errors = download_files(
+            session, download_jobs, jobs, chunk_size * 1024, segments
+        )
+    if apk_store is not None:
+        for job, apk_key, error in zip(download_jobs, apk_keys, errors):
+            if error is None:
+                apk_store.add(apk_key, job.output_file)
+    failed = [
+        (job, error) for (job, error) in zip(download_jobs, errors) if error is not None
+    ]
+    for job, error in failed:
+        click.echo(f"Failed to download {job.output_file}: {error}", err=True)
+    if failed:
+        raise click.ClickException(
+            f"{len(failed)} of {len(download_jobs)} downloads failed. "
+            "Run the command again to resume them."
+        )
+
+
+_from_file_option = click.option(
+    "-f",
+    "--from-file",
+    type=click.File("r"),
+    help="Read `[APP] BUILD_NUM...` lines from a file, or - for stdin. "
+    "Lines without an app update the selected app.",
+    default=None,
+)
+_jobs_option = click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    help="Maximum number of concurrent updates.",
+    default=DEFAULT_MAX_WORKERS,
+)
+_batch_size_option = click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    help="Maximum number of builds per update request.",
+    default=DEFAULT_BATCH_SIZE,
+)
+
+
+def _collect_builds(
+    context: NBPCommandContext, build: Sequence[int], from_file: Optional[TextIO]
+) -> Dict[str, List[int]]:
+    selectors = parse_build_selectors(from_file) if from_file is not None else []
+    builds_by_app = context.group_builds_by_app(build, selectors)
+    if not builds_by_app:
+        raise click.UsageError("No builds specified.")
+    return builds_by_app
+
+
+def _report_batches(results: Sequence[BatchResult], action: str) -> None:
+    num_failed = 0
+    for result in results:
+        for build_num in result.build_nums:
+            if result.error is None:
+                click.echo(f"{result.app_code} #{build_num}: {action}")
+            else:
+                click.echo(
+                    f"{result.app_code} #{build_num}: failed, {result.error}", err=True
+                )
+                num_failed += 1
+    if num_failed:
+        num_builds = sum(len(result.build_nums) for result in results)
+        raise click.ClickException(f"{num_failed} of {num_builds} builds failed.")
+
+
+@builds.command("watch")
+@click.argument("build_nums", type=int, nargs=-1)
+@click.pass_context
+def builds_watch(ctx: click.Context, build_nums: Sequence[int]) -> None:
+    """Follow builds until they finish.
+
+    Without build numbers, follows all running builds of the selected workflows.
+    """
+    context: NBPCommandContext = ctx.obj
+    app_entry = context.app_entry
+    with BitriseClient() as bitrise_client:
+        if build_nums:
+            builds = []
+            for build_num in build_nums:
+                matches = bitrise_client.list_builds(
+                    app_entry.slug, build_number=build_num
+                )
+                if not matches:
+                    raise click.UsageError(f"Could not find build {build_num}")
+                builds.extend(matches)
+        else:
+            filters = {"status": 0}
+            if context.branch:
+                filters["branch"] = context.branch
+            builds = [
+                build
+                for workflow in context.workflows
+                for build in bitrise_client.list_builds(
+                    app_entry.slug, workflow=workflow, **filters
+                )
+            ]
+            if not builds:
+                click.echo("No running builds.")
+                return
+        watch_builds(
+            bitrise_client,
+            app_entry.slug,
+            [
+                WatchedBuild(
+                    build["slug"], build["build_number"], build["triggered_workflow"]
+                )
+                for build in builds
+            ],
+        )
 
 
 @builds.command("tag")
@@ -420,15 +765,32 @@ def builds_apk(ctx: click.Context, build_nums: Sequence[int], output: str) -> No
 @click.option(
     "-t", "--tag", type=click.STRING, multiple=True, help="Tags to add/remove."
 )
+@_from_file_option
+@_jobs_option
+@_batch_size_option
 @click.pass_context
 def builds_tag(
-    ctx: click.Context, build: Sequence[int], remove: bool, tag: Sequence[str]
+    ctx: click.Context,
+    build: Sequence[int],
+    remove: bool,
+    tag: Sequence[str],
+    from_file: Optional[TextIO],
+    jobs: int,
+    batch_size: int,
 ) -> None:
     """Tag specific builds"""
     context: NBPCommandContext = ctx.obj
-    app_entry = context.app_entry
-    bitrise_index_client = context.bitrise_index_client
-    bitrise_index_client.update_tag(app_entry.app_code, build, remove, tag)
+    builds_by_app = _collect_builds(context, build, from_file)
+    results = run_batches(
+        builds_by_app,
+        BitriseIndexClient,
+        lambda client, app_code, build_nums: client.update_tag(
+            app_code, build_nums, remove, tag
+        ),
+        jobs,
+        batch_size,
+    )
+    _report_batches(results, "untagged" if remove else "tagged")
 
 
 @builds.command("memo")
@@ -440,20 +802,60 @@ def builds_tag(
     multiple=True,
 )
 @click.option("-e", "--edit", is_flag=True, help="Edit the memo instead of appending.")
+@_from_file_option
+@_jobs_option
+@_batch_size_option
 @click.pass_context
-def builds_memo(ctx: click.Context, build: Sequence[int], edit: bool) -> None:
+def builds_memo(
+    ctx: click.Context,
+    build: Sequence[int],
+    edit: bool,
+    from_file: Optional[TextIO],
+    jobs: int,
+    batch_size: int,
+) -> None:
     """Add memo to builds."""
     context: NBPCommandContext = ctx.obj
-    app_entry = context.app_entry
+    builds_by_app = _collect_builds(context, build, from_file)
     bitrise_index_client = context.bitrise_index_client
     template = ""
     if edit:
-        builds = bitrise_index_client.fetch_builds(app_entry.app_code, build)
-        # Use the first build memo as the template.
+        # Use the first build memo as the template, only that build is fetched.
+        (app_code, build_nums) = next(iter(builds_by_app.items()))
+        builds = bitrise_index_client.fetch_builds(app_code, build_nums[:1])
         if builds:
             template = builds[0].memo
     memo = click.edit(template)
     if not memo:
         click.echo("No memo specified", err=True)
-    else:
-        bitrise_index_client.add_memo(app_entry.app_code, build, edit, memo)
+        return
+    results = run_batches(
+        builds_by_app,
+        BitriseIndexClient,
+        lambda client, app_code, build_nums: client.add_memo(
+            app_code, build_nums, edit, memo
+        ),
+        jobs,
+        batch_size,
+    )
+    _report_batches(results, "memo updated")
+
+
+@nbp.group("cache")
+def cache() -> None:
+    """Manage local caches."""
+
+
+@cache.command("prune")
+@click.option(
+    "-m",
+    "--max-size",
+    type=click.FloatRange(min=0),
+    help="Size in GiB to prune the apk store down to. Defaults to the configured cap.",
+    default=None,
+)
+def cache_prune(max_size: Optional[float]) -> None:
+    """Evict least recently used apks from the local apk store."""
+    max_bytes = None if max_size is None else int(max_size * (1 << 30))
+    (num_removed, freed) = ApkStore().prune(max_bytes)
+    click.echo(f"Removed {num_removed} apks, freeing {freed / (1 << 20):.1f} MiB.")
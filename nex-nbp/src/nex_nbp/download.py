@@ -0,0 +1,367 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import os.path
+import re
+import threading
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence
+
+import click
+import requests
+from tqdm import tqdm
+
+DEFAULT_CHUNK_SIZE = 1 << 20
+DEFAULT_MAX_RETRIES = 5
+# (connect, read) timeouts in seconds, so that a stalled transfer is retried.
+DEFAULT_TIMEOUT = (10, 60)
+PART_SUFFIX = ".part"
+# Written next to a .part file, recording which download it belongs to.
+CHECKPOINT_SUFFIX = ".json"
+# Files are only split when every segment gets at least this many bytes.
+MIN_SEGMENT_SIZE = 8 << 20
+_RETRYABLE_ERRORS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+)
+
+
+class DownloadJob(NamedTuple):
+    url: str
+    output_file: str
+    byte_size: Optional[int] = None
+    # Identifies the downloaded content across runs, e.g. the build and artifact.
+    # Defaults to the URL without its query, since download URLs are often presigned.
+    identity: Optional[str] = None
+
+
+def _get_checkpoint(job: DownloadJob) -> Dict:
+    identity = job.identity if job.identity is not None else job.url.split("?")[0]
+    return {"identity": identity, "byte_size": job.byte_size}
+
+
+def _save_checkpoint(job: DownloadJob, part_file: str) -> None:
+    with open(part_file + CHECKPOINT_SUFFIX, "w") as file:
+        json.dump(_get_checkpoint(job), file)
+
+
+def _discard_stale_part(job: DownloadJob, part_file: str) -> None:
+    """Remove a .part file unless its checkpoint shows that it belongs to job."""
+    checkpoint_file = part_file + CHECKPOINT_SUFFIX
+    try:
+        with open(checkpoint_file) as file:
+            checkpoint = json.load(file)
+    except (OSError, ValueError):
+        checkpoint = None
+    if checkpoint == _get_checkpoint(job):
+        return
+    # A leftover of another artifact, or of a run that did not record one.
+    for path in (part_file, checkpoint_file):
+        if os.path.isfile(path):
+            os.remove(path)
+
+
+def _download_to_part(
+    session: requests.Session,
+    job: DownloadJob,
+    part_file: str,
+    chunk_size: int,
+    pbar: tqdm,
+    total_pbar: Optional[tqdm],
+) -> None:
+    offset = os.path.getsize(part_file) if os.path.isfile(part_file) else 0
+    pbar.reset(total=job.byte_size)
+    if job.byte_size is not None and offset == job.byte_size:
+        pbar.update(offset)
+        return  # Already complete, from an earlier run.
+
+    def restart() -> int:
+        if total_pbar is not None:
+            total_pbar.update(-offset)
+        return 0
+
+    if job.byte_size is not None and offset > job.byte_size:
+        offset = restart()  # Leftover of a different file.
+    headers = {"Range": f"bytes={offset}-"} if offset > 0 else {}
+    with session.get(
+        job.url, stream=True, headers=headers, timeout=DEFAULT_TIMEOUT
+    ) as response:
+        response.raise_for_status()
+        if offset > 0 and response.status_code != 206:
+            offset = restart()  # The server ignored the range.
+        pbar.update(offset)
+        if offset == 0:
+            _save_checkpoint(job, part_file)
+        with open(part_file, "ab" if offset > 0 else "wb") as file:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if chunk:
+                    file.write(chunk)
+                    pbar.update(len(chunk))
+                    if total_pbar is not None:
+                        total_pbar.update(len(chunk))
+
+
+def _supports_ranges(session: requests.Session, url: str) -> bool:
+    # A ranged GET rather than HEAD, since presigned URLs are often only valid for GET.
+    with session.get(
+        url, stream=True, headers={"Range": "bytes=0-0"}, timeout=DEFAULT_TIMEOUT
+    ) as response:
+        return response.status_code == 206
+
+
+def _download_segment(
+    session: requests.Session,
+    url: str,
+    fd: int,
+    start: int,
+    end: int,
+    byte_size: int,
+    chunk_size: int,
+    max_retries: int,
+    update: Callable[[int], None],
+    cancel: threading.Event,
+) -> int:
+    """Download bytes [start, end] of url into fd at the same offsets.
+
+    Returns the number of bytes written, checking that every response covers the
+    requested range of a file of byte_size bytes. Stops early once cancel is set.
+    """
+    offset = start
+    attempt = 0
+    while offset <= end and not cancel.is_set():
+        try:
+            with session.get(
+                url,
+                stream=True,
+                headers={"Range": f"bytes={offset}-{end}"},
+                timeout=DEFAULT_TIMEOUT,
+            ) as response:
+                response.raise_for_status()
+                if response.status_code != 206:
+                    raise click.ClickException(
+                        f"Server stopped honoring ranges for {url}"
+                    )
+                content_range = response.headers.get("Content-Range", "")
+                if not re.fullmatch(rf"bytes {offset}-\d+/{byte_size}", content_range):
+                    raise click.ClickException(
+                        f"Requested bytes {offset}-{end} of {url}, "
+                        f"got '{content_range}'"
+                    )
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    if cancel.is_set():
+                        return offset - start
+                    if chunk:
+                        chunk = chunk[: end + 1 - offset]
+                        os.pwrite(fd, chunk, offset)
+                        offset += len(chunk)
+                        update(len(chunk))
+        except _RETRYABLE_ERRORS:
+            pass
+        if offset <= end:
+            # Either an error or a short response, resume where it stopped.
+            if attempt == max_retries:
+                raise click.ClickException(
+                    f"Failed to download bytes {offset}-{end} of {url}"
+                )
+            attempt += 1
+    return offset - start
+
+
+def _download_segmented(
+    session: requests.Session,
+    job: DownloadJob,
+    part_file: str,
+    segments: int,
+    chunk_size: int,
+    max_retries: int,
+    pbar: tqdm,
+    total_pbar: Optional[tqdm],
+) -> None:
+    lock = threading.Lock()
+
+    def update(size: int) -> None:
+        with lock:
+            pbar.update(size)
+            if total_pbar is not None:
+                total_pbar.update(size)
+
+    byte_size = job.byte_size
+    segment_size = -(-byte_size // segments)
+    cancel = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=segments)
+    fd = os.open(part_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        if hasattr(os, "posix_fallocate"):
+            os.posix_fallocate(fd, 0, byte_size)
+        else:
+            os.ftruncate(fd, byte_size)
+        futures = [
+            executor.submit(
+                _download_segment,
+                session,
+                job.url,
+                fd,
+                start,
+                min(start + segment_size, byte_size) - 1,
+                byte_size,
+                chunk_size,
+                max_retries,
+                update,
+                cancel,
+            )
+            for start in range(0, byte_size, segment_size)
+        ]
+        written = sum(future.result() for future in futures)
+        if written != byte_size:
+            raise click.ClickException(
+                f"Downloaded {written} bytes for {job.output_file}, "
+                f"expecting {byte_size}"
+            )
+    except BaseException:
+        # The other segments stop at their next chunk, rather than downloading the
+        # rest of the file first. They still write to fd until then.
+        cancel.set()
+        executor.shutdown(cancel_futures=True)
+        # A preallocated file with holes must never be mistaken for a resumable one.
+        # It has no checkpoint either, so a later run discards it if it is left over.
+        os.close(fd)
+        fd = -1
+        os.remove(part_file)
+        raise
+    finally:
+        executor.shutdown()
+        if fd != -1:
+            os.close(fd)
+
+
+def download_file(
+    session: requests.Session,
+    job: DownloadJob,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    position: Optional[int] = None,
+    total_pbar: Optional[tqdm] = None,
+    segments: int = 1,
+) -> str:
+    """Download job.url to job.output_file, resuming from a .part file if there is one.
+
+    Interrupted transfers are retried from where they stopped with HTTP Range requests.
+    A .part file is only resumed if its checkpoint matches the identity and size of
+    job, otherwise it is downloaded again.
+    With segments > 1, a large file is split into byte ranges that are fetched over
+    parallel connections, falling back to a single stream if the server does not
+    support ranges.
+    """
+    part_file = job.output_file + PART_SUFFIX
+    _discard_stale_part(job, part_file)
+    if job.byte_size is not None:
+        segments = min(segments, job.byte_size // MIN_SEGMENT_SIZE)
+    use_segments = (
+        segments > 1
+        and hasattr(os, "pwrite")
+        # A partial single stream download is resumed as is.
+        and not os.path.isfile(part_file)
+        and _supports_ranges(session, job.url)
+    )
+    with tqdm(
+        total=job.byte_size,
+        unit="B",
+        unit_scale=True,
+        unit_divisor=1024,
+        desc=os.path.basename(job.output_file),
+        position=position,
+        leave=position is None,
+    ) as pbar:
+        if use_segments:
+            _download_segmented(
+                session,
+                job,
+                part_file,
+                segments,
+                chunk_size,
+                max_retries,
+                pbar,
+                total_pbar,
+            )
+        else:
+            if total_pbar is not None and os.path.isfile(part_file):
+                total_pbar.update(os.path.getsize(part_file))
+            for attempt in range(max_retries + 1):
+                try:
+                    _download_to_part(
+                        session, job, part_file, chunk_size, pbar, total_pbar
+                    )
+                    break
+                except _RETRYABLE_ERRORS as ex:
+                    if attempt == max_retries:
+                        raise
+                    pbar.write(f"{job.output_file}: {ex}, resuming.")
+
+    # Segmented downloads are preallocated, their segments are checked as they finish.
+    if job.byte_size is not None and os.path.getsize(part_file) != job.byte_size:
+        size = os.path.getsize(part_file)
+        # Resuming it would only ask for bytes past its end, so it starts over instead.
+        for path in (part_file, part_file + CHECKPOINT_SUFFIX):
+            if os.path.isfile(path):
+                os.remove(path)
+        raise click.ClickException(
+            f"Downloaded {size} bytes for {job.output_file}, "
+            f"expecting {job.byte_size}"
+        )
+    os.replace(part_file, job.output_file)
+    if os.path.isfile(part_file + CHECKPOINT_SUFFIX):
+        os.remove(part_file + CHECKPOINT_SUFFIX)
+    return job.output_file
+
+
+def download_files(
+    session: requests.Session,
+    jobs: Sequence[DownloadJob],
+    max_workers: int = 4,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    segments: int = 1,
+) -> List[Optional[Exception]]:
+    """Download jobs concurrently, showing a bar per file and a bar for the total.
+
+    Returns the error of each job, or None if it succeeded.
+    """
+    if not jobs:
+        return []
+    if all(job.byte_size is not None for job in jobs):
+        total = sum(job.byte_size for job in jobs)
+    else:
+        total = None
+    # Bar positions are handed out as downloads start, so at most max_workers are used.
+    positions = list(range(max_workers, 0, -1))
+    lock = threading.Lock()
+
+    with tqdm(
+        total=total,
+        unit="B",
+        unit_scale=True,
+        unit_divisor=1024,
+        desc="Total",
+        position=0,
+    ) as total_pbar:
+
+        def run(job: DownloadJob) -> Optional[Exception]:
+            with lock:
+                position = positions.pop()
+            try:
+                download_file(
+                    session,
+                    job,
+                    chunk_size,
+                    position=position,
+                    total_pbar=total_pbar,
+                    segments=segments,
+                )
+                return None
+            except Exception as ex:
+                return ex
+            finally:
+                with lock:
+                    positions.append(position)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(run, jobs))
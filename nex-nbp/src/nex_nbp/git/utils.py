@@ -1,18 +1,55 @@
+from functools import cached_property
 import os
 import os.path
 from pathlib import Path
-from typing import Optional
+import re
+from typing import Dict, Optional, Tuple
 
-from git import Repo
+# Matches `[section]` and `[section "subsection"]` headers of a git config file.
+_SECTION_RE = re.compile(r'\[\s*([-.\w]+)(?:\s+"((?:[^"\\]|\\.)*)")?\s*\]')
+
+
+def _parse_git_config(text: str) -> Dict[Tuple[str, Optional[str]], Dict[str, str]]:
+    """Parse a git config into {(section, subsection): {key: value}}.
+
+    Only covers what GitInfo reads: no includes, and keys keep their last value.
+    """
+    config: Dict[Tuple[str, Optional[str]], Dict[str, str]] = {}
+    values: Dict[str, str] = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line[0] in "#;":
+            continue
+        if line.startswith("["):
+            match = _SECTION_RE.match(line)
+            if match is None:
+                values = {}
+                continue
+            subsection = match.group(2)
+            if subsection is not None:
+                subsection = re.sub(r"\\(.)", r"\1", subsection)
+            values = config.setdefault((match.group(1).lower(), subsection), {})
+            line = line[match.end() :].strip()
+            if not line:
+                continue
+        key, sep, value = line.partition("=")
+        value = value.strip() if sep else "true"
+        if len(value) >= 2 and value[0] == value[-1] == '"':
+            value = value[1:-1]
+        values[key.strip().lower()] = value
+    return config
 
 
 class GitInfo:
+    """Remote url and branch of the enclosing git repo.
+
+    Reads .git/config and HEAD directly rather than through git, and only when asked.
+    """
+
     @classmethod
     def _find_gitdir(cls) -> Optional[str]:
-        if os.path.exists(".git"):
-            return "."
         curr = Path(os.getcwd())
-        for p in curr.parents:
+        for p in (curr, *curr.parents):
             if os.path.exists(os.path.join(p, ".git")):
                 return str(p)
         return None
@@ -25,20 +62,57 @@ class GitInfo:
         return cls(gitdir)
 
     def __init__(self, gitdir: str):
-        repo = Repo(gitdir)
-        self._remote_url = repo.remote("origin").url
-        active_branch = repo.active_branch
-        tracking_branch = active_branch.tracking_branch()
-        self._remote_name = (
-            tracking_branch.remote_head
-            if tracking_branch is not None
-            else active_branch.name
-        )
-
-    @property
-    def remote_url(self) -> str:
-        return self._remote_url
-
-    @property
-    def remote_name(self) -> str:
-        return self._remote_name
+        self._worktree = gitdir
+
+    @cached_property
+    def _git_dir(self) -> str:
+        dot_git = os.path.join(self._worktree, ".git")
+        if os.path.isfile(dot_git):
+            # Worktrees and submodules have a `gitdir: <path>` file instead.
+            with open(dot_git, "r", encoding="utf-8") as file:
+                content = file.read().strip()
+            if not content.startswith("gitdir:"):
+                raise ValueError(f"Invalid .git file in {self._worktree}")
+            return os.path.join(self._worktree, content[len("gitdir:") :].strip())
+        return dot_git
+
+    @cached_property
+    def _common_dir(self) -> str:
+        # Linked worktrees share the config and refs of the main repo.
+        commondir_file = os.path.join(self._git_dir, "commondir")
+        if os.path.isfile(commondir_file):
+            with open(commondir_file, "r", encoding="utf-8") as file:
+                return os.path.join(self._git_dir, file.read().strip())
+        return self._git_dir
+
+    @cached_property
+    def _config(self) -> Dict[Tuple[str, Optional[str]], Dict[str, str]]:
+        with open(
+            os.path.join(self._common_dir, "config"), "r", encoding="utf-8"
+        ) as file:
+            return _parse_git_config(file.read())
+
+    @cached_property
+    def _active_branch(self) -> Optional[str]:
+        """The checked out branch, None if HEAD is detached."""
+        with open(os.path.join(self._git_dir, "HEAD"), "r", encoding="utf-8") as file:
+            head = file.read().strip()
+        prefix = "ref: refs/heads/"
+        return head[len(prefix) :] if head.startswith(prefix) else None
+
+    @cached_property
+    def remote_url(self) -> Optional[str]:
+        return self._config.get(("remote", "origin"), {}).get("url")
+
+    @cached_property
+    def remote_name(self) -> Optional[str]:
+        """Name of the branch tracked by the active branch, or the active branch."""
+        active_branch = self._active_branch
+        if active_branch is None:
+            return None
+        branch_config = self._config.get(("branch", active_branch), {})
+        merge = branch_config.get("merge", "")
+        prefix = "refs/heads/"
+        if "remote" in branch_config and merge.startswith(prefix):
+            return merge[len(prefix) :]
+        return active_branch
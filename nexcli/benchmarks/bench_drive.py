@@ -0,0 +1,173 @@
+"""Benchmark the startup, download and upload paths of `nex drive` against a fake Drive.
+
+Runs `nex drive download`, `nex drive download-folder` and `nex drive upload` in
+fresh processes, which covers import, credential loading and service construction,
+and compares building a Drive service per call with the service and discovery
+document shared in-process. Reports wall time and request count for each.
+
+    python benchmarks/bench_drive.py --latency 0.1
+"""
+
+from datetime import datetime, timedelta, timezone
+import json
+import os
+from pathlib import Path
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, List, Tuple
+
+import click
+from googleapiclient.discovery import build
+from tabulate import tabulate
+
+from fake_drive import FakeDrive, FakeDriveConfig
+from nexcli.drive import service
+
+# Runs the drive commands of `nex` against the fake, in a process of their own. Token
+# files always refresh at Google's token endpoint, so that is redirected as well.
+_DRIVE_CLI = (
+    "import sys\n"
+    "from google.oauth2 import credentials\n"
+    "from nexcli.drive import cli, service\n"
+    "service.API_ROOT_URL = sys.argv[1]\n"
+    "credentials._GOOGLE_OAUTH2_TOKEN_ENDPOINT = sys.argv[2]\n"
+    "cli(sys.argv[3:])\n"
+)
+
+
+def _measure(
+    server: FakeDrive, results: List[Tuple], name: str, func: Callable[[], object]
+) -> object:
+    server.reset_counts()
+    start = time.perf_counter()
+    ret = func()
+    elapsed = time.perf_counter() - start
+    results.append((name, f"{elapsed:.3f}", server.total_requests))
+    return ret
+
+
+def _write_token(home: Path, expires_in: timedelta) -> None:
+    expiry = datetime.now(timezone.utc) + expires_in
+    # Downloads and uploads are authorized with separate tokens
+    for name, scopes in (
+        ("google_drive_token.json", service.SCOPES),
+        ("google_drive_upload_token.json", service.UPLOAD_SCOPES),
+    ):
+        token = {
+            "token": "fake",
+            "refresh_token": "fake",
+            "client_id": "fake",
+            "client_secret": "fake",
+            "scopes": scopes,
+            "expiry": expiry.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        }
+        token_file = home / ".nexcli" / name
+        token_file.parent.mkdir(parents=True, exist_ok=True)
+        token_file.write_text(json.dumps(token))
+
+
+@click.command()
+@click.option("--latency", type=float, default=0.05, help="Seconds per response.")
+@click.option("--files", "num_files", type=int, default=8, help="Files in the folder.")
+@click.option("--file-size", type=int, default=4, help="File size in MiB.")
+@click.option(
+    "--sheets", "num_sheets", type=int, default=4, help="Spreadsheets in the folder."
+)
+@click.option(
+    "--calls", type=int, default=20, help="Services built per in-process scenario."
+)
+def main(
+    latency: float, num_files: int, file_size: int, num_sheets: int, calls: int
+) -> None:
+    config = FakeDriveConfig(
+        num_files=num_files,
+        file_size=file_size << 20,
+        num_sheets=num_sheets,
+        latency=latency,
+    )
+    results: List[Tuple] = []
+    with FakeDrive(config) as server, tempfile.TemporaryDirectory() as tmp_dir:
+        home = Path(tmp_dir) / "home"
+        work_dir = Path(tmp_dir) / "work"
+        work_dir.mkdir()
+        env = {**os.environ, "HOME": str(home)}
+
+        def run_drive(*args: str) -> None:
+            subprocess.run(
+                [
+                    sys.executable,
+                    "-c",
+                    _DRIVE_CLI,
+                    server.root_url,
+                    server.token_uri,
+                    *args,
+                ],
+                cwd=work_dir,
+                env=env,
+                check=True,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+
+        file_url = server.file_url("file0")
+        _write_token(home, timedelta(hours=1))
+        _measure(
+            server,
+            results,
+            "nex drive download",
+            lambda: run_drive("download", file_url),
+        )
+        _measure(
+            server,
+            results,
+            "nex drive download (unchanged)",
+            lambda: run_drive("download", file_url),
+        )
+        _write_token(home, timedelta(minutes=1))
+        _measure(
+            server,
+            results,
+            "nex drive download (token expiring)",
+            lambda: run_drive("download", file_url),
+        )
+        _measure(
+            server,
+            results,
+            "nex drive download-folder",
+            lambda: run_drive("download-folder", server.folder_url, "--export", "csv"),
+        )
+        uploads = sorted(str(path) for path in work_dir.glob("file*.bin"))
+        for jobs in (1, service.MAX_WORKERS):
+            _measure(
+                server,
+                results,
+                f"nex drive upload ({jobs} jobs)",
+                lambda: run_drive(
+                    "upload", *uploads, server.folder_url, "--jobs", str(jobs)
+                ),
+            )
+
+        # Building services in this process, as every download used to do
+        _write_token(home, timedelta(hours=1))
+        service.USER_AUTH_TOKEN = home / ".nexcli/google_drive_token.json"
+        creds = service.get_credentials()
+        _measure(
+            server,
+            results,
+            f"build drive service x{calls} (per call)",
+            lambda: [build("drive", "v3", credentials=creds) for _ in range(calls)],
+        )
+        _measure(
+            server,
+            results,
+            f"create_service x{calls} (shared)",
+            lambda: [service.create_service() for _ in range(calls)],
+        )
+
+    click.echo(tabulate(results, headers=("Scenario", "Seconds", "Requests")))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+"""A local stand-in for the parts of the Google Drive API used by `nex drive`.
+
+Serves file metadata, folder listings, media downloads (with Range support), exports
+of spreadsheets, resumable uploads and OAuth token refreshes, with configurable
+latency and failure injection of upload chunks. Requests are counted per route,
+so benchmarks can compare both wall time and round trips.
+"""
+
+from collections import Counter
+from dataclasses import dataclass
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import re
+import threading
+import time
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+FOLDER_ID = "folder"
+
+
+@dataclass
+class FakeDriveConfig:
+    # Files in the folder, named file0.bin to file{num_files - 1}.bin.
+    num_files: int = 8
+    file_size: int = 4 << 20
+    # Spreadsheets in the folder, named sheet0 to sheet{num_sheets - 1}.
+    num_sheets: int = 4
+    sheet_rows: int = 1000
+    # Seconds added to every response.
+    latency: float = 0.05
+    # Probability of answering an upload chunk with a 503.
+    upload_failure_rate: float = 0.0
+    seed: int = 0
+
+
+class FakeDrive:
+    """In-process fake Drive API server, usable as a context manager."""
+
+    def __init__(self, config: Optional[FakeDriveConfig] = None):
+        self.config = FakeDriveConfig() if config is None else config
+        self.requests: Counter = Counter()
+        self._lock = threading.Lock()
+        self._random = random.Random(self.config.seed)
+        # Received bytes of resumable upload sessions, and the uploaded files
+        self._uploads: Dict[str, Dict] = {}
+        self.uploaded: Dict[str, bytes] = {}
+        self._files = {
+            f"file{i}": bytes([i % 256]) * self.config.file_size
+            for i in range(self.config.num_files)
+        }
+        self._sheets = {
+            f"sheet{i}": "".join(
+                f"key_{row},value {row} of sheet {i}\n"
+                for row in range(self.config.sheet_rows)
+            ).encode("utf-8")
+            for i in range(self.config.num_sheets)
+        }
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        (host, port) = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def root_url(self) -> str:
+        return f"{self.url}/"
+
+    @property
+    def token_uri(self) -> str:
+        return f"{self.url}/token"
+
+    def file_url(self, file_id: str) -> str:
+        return f"https://drive.google.com/file/d/{file_id}/view"
+
+    @property
+    def folder_url(self) -> str:
+        return f"https://drive.google.com/drive/folders/{FOLDER_ID}"
+
+    def start(self) -> "FakeDrive":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeDrive":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def reset_counts(self) -> None:
+        with self._lock:
+            self.requests.clear()
+
+    @property
+    def total_requests(self) -> int:
+        with self._lock:
+            return sum(self.requests.values())
+
+    def _count(self, route: str) -> None:
+        with self._lock:
+            self.requests[route] += 1
+
+    def _should_fail_upload(self) -> bool:
+        with self._lock:
+            return self._random.random() < self.config.upload_failure_rate
+
+    def _start_upload(self, metadata: Dict) -> str:
+        with self._lock:
+            upload_id = f"upload{len(self._uploads)}"
+            self._uploads[upload_id] = {"metadata": metadata, "data": bytearray()}
+        return f"{self.url}/upload/drive/v3/files?uploadType=resumable&upload_id={upload_id}"
+
+    def _metadata(self, file_id: str) -> Dict:
+        if file_id in self._sheets:
+            return {
+                "id": file_id,
+                "name": file_id,
+                "mimeType": "application/vnd.google-apps.spreadsheet",
+                "modifiedTime": "2024-01-01T00:00:00.000Z",
+            }
+        data = self._files[file_id]
+        return {
+            "id": file_id,
+            "name": f"{file_id}.bin",
+            "mimeType": "application/octet-stream",
+            "size": str(len(data)),
+            "md5Checksum": hashlib.md5(data).hexdigest(),
+            "modifiedTime": "2024-01-01T00:00:00.000Z",
+        }
+
+    def _list(self, query: Dict[str, str]) -> Dict:
+        match = re.match(r"'([^']+)' in parents", query.get("q", ""))
+        files: List[Dict] = []
+        if match is not None and match.group(1) == FOLDER_ID:
+            files = [
+                self._metadata(file_id) for file_id in [*self._files, *self._sheets]
+            ]
+        return {"files": files}
+
+    # HTTP handling.
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args) -> None:
+                pass
+
+            def _send_json(self, status: int, data: Dict) -> None:
+                body = json.dumps(data).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_range(self, payload: bytes) -> None:
+                size = len(payload)
+                (start, end) = (0, size - 1)
+                match = re.fullmatch(
+                    r"bytes=(\d+)-(\d*)", self.headers.get("Range", "")
+                )
+                if match is not None:
+                    start = int(match.group(1))
+                    end = min(int(match.group(2) or size - 1), size - 1)
+                    self.send_response(206)
+                    self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+                else:
+                    self.send_response(200)
+                self.send_header("Content-Length", str(end + 1 - start))
+                self.end_headers()
+                self.wfile.write(payload[start : end + 1])
+
+            def _upload_chunk(self, upload_id: str, body: bytes) -> None:
+                upload = fake._uploads.get(upload_id)
+                if upload is None:
+                    self._send_json(404, {"error": {"message": "No such upload"}})
+                    return
+                data = upload["data"]
+                # Content-Range is `bytes start-end/total`, or `bytes */total` to ask
+                # how much was received.
+                match = re.fullmatch(
+                    r"bytes (?:(\d+)-\d+|\*)/(\d+|\*)",
+                    self.headers.get("Content-Range", ""),
+                )
+                if match is None:
+                    self._send_json(400, {"error": {"message": "Bad Content-Range"}})
+                    return
+                if match.group(1) is not None:
+                    if fake._should_fail_upload():
+                        self._send_json(503, {"error": {"message": "Injected"}})
+                        return
+                    del data[int(match.group(1)) :]
+                    data.extend(body)
+                if match.group(2) != "*" and len(data) == int(match.group(2)):
+                    with fake._lock:
+                        file_id = f"uploaded{len(fake.uploaded)}"
+                        fake.uploaded[file_id] = bytes(data)
+                    self._send_json(
+                        200,
+                        {
+                            "id": file_id,
+                            "name": upload["metadata"].get("name"),
+                            "size": str(len(data)),
+                            "md5Checksum": hashlib.md5(data).hexdigest(),
+                        },
+                    )
+                    return
+                self.send_response(308)
+                if data:
+                    self.send_header("Range", f"bytes=0-{len(data) - 1}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def _handle(self, method: str) -> None:
+                url = urlparse(self.path)
+                query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                body = b""
+                if "Content-Length" in self.headers:
+                    body = self.rfile.read(int(self.headers["Content-Length"]))
+                time.sleep(fake.config.latency)
+
+                match = re.fullmatch(r"/drive/v3/files/([^/]+)", url.path)
+                export_match = re.fullmatch(r"/drive/v3/files/([^/]+)/export", url.path)
+                if method == "POST" and url.path == "/token":
+                    fake._count("POST token")
+                    self._send_json(
+                        200,
+                        {
+                            "access_token": "fake",
+                            "expires_in": 3600,
+                            "token_type": "Bearer",
+                        },
+                    )
+                elif method == "POST" and url.path == "/upload/drive/v3/files":
+                    fake._count("POST upload")
+                    location = fake._start_upload(json.loads(body or b"{}"))
+                    self.send_response(200)
+                    self.send_header("Location", location)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                elif method == "PUT" and url.path == "/upload/drive/v3/files":
+                    fake._count("PUT upload")
+                    self._upload_chunk(query.get("upload_id", ""), body)
+                elif method == "GET" and url.path == "/drive/v3/files":
+                    fake._count("GET files")
+                    self._send_json(200, fake._list(query))
+                elif method == "GET" and export_match is not None:
+                    file_id = export_match.group(1)
+                    if file_id not in fake._sheets:
+                        fake._count("GET unknown")
+                        self._send_json(404, {"error": {"message": "Not found"}})
+                    elif query.get("mimeType") != "text/csv":
+                        # Only csv is generated, other formats are not worth faking
+                        fake._count("GET export")
+                        self._send_json(400, {"error": {"message": "Bad format"}})
+                    else:
+                        fake._count("GET export")
+                        self._send_range(fake._sheets[file_id])
+                elif method == "GET" and match is not None:
+                    file_id = match.group(1)
+                    if file_id in fake._sheets:
+                        fake._count("GET file")
+                        self._send_json(200, fake._metadata(file_id))
+                    elif file_id not in fake._files:
+                        fake._count("GET unknown")
+                        self._send_json(404, {"error": {"message": "Not found"}})
+                    elif query.get("alt") == "media":
+                        fake._count("GET media")
+                        self._send_range(fake._files[file_id])
+                    else:
+                        fake._count("GET file")
+                        self._send_json(200, fake._metadata(file_id))
+                else:
+                    fake._count(f"{method} unknown")
+                    self._send_json(404, {"error": {"message": "Not found"}})
+
+            def do_GET(self) -> None:
+                self._handle("GET")
+
+            def do_POST(self) -> None:
+                self._handle("POST")
+
+            def do_PUT(self) -> None:
+                self._handle("PUT")
+
+        return Handler
@@ -9,19 +9,99 @@ def cli():
     pass
 
 
+_chunk_size_option = click.option(
+    "--chunk-size",
+    type=click.IntRange(min=1),
+    default=service.DEFAULT_CHUNK_SIZE // (1024 * 1024),
+    help="Download or upload chunk size in MiB.",
+)
+
+_export_option = click.option(
+    "-x",
+    "--export",
+    "export_formats",
+    type=click.Choice(
+        sorted({f for formats in service.EXPORT_FORMATS.values() for f in formats})
+    ),
+    multiple=True,
+    help="Format to export Google Docs, Sheets, Slides and Drawings to, e.g. csv "
+    "for the first sheet of a spreadsheet. Repeat for several types, the others "
+    "are exported to docx, xlsx, pptx or pdf.",
+)
+
+
+@click.command()
+@click.argument("url", type=str)
+@_chunk_size_option
+@_export_option
+def download(url, chunk_size, export_formats):
+    """Download a file from Google Drive from a shareable link.
+
+    A file that was downloaded before and has not changed since is copied from the
+    earlier download instead.
+    """
+    service.download(
+        url, chunk_size=chunk_size * 1024 * 1024, export_formats=export_formats
+    )
+
+
 @click.command()
 @click.argument("url", type=str)
-def download(url):
-    """Download a file from Google Drive from a shareable link."""
-    service.download(url)
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=service.MAX_WORKERS,
+    help="Maximum number of concurrent downloads.",
+)
+@click.option(
+    "-o",
+    "--output",
+    type=click.Path(file_okay=False),
+    default=".",
+    help="Directory to sync the folder into.",
+)
+@_chunk_size_option
+@_export_option
+def download_folder(url, jobs, output, chunk_size, export_formats):
+    """Download all files below a Google Drive folder link, including subfolders.
+
+    Files that are already up to date locally are skipped. Google Docs, Sheets,
+    Slides and Drawings are exported.
+    """
+    service.download_folder(
+        url,
+        output,
+        max_workers=jobs,
+        chunk_size=chunk_size * 1024 * 1024,
+        export_formats=export_formats,
+    )
 
 
 @click.command()
+@click.argument(
+    "paths", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False)
+)
 @click.argument("url", type=str)
-def download_folder(url):
-    """Download all files from a Google Drive folder link."""
-    service.download_folder(url)
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=service.MAX_WORKERS,
+    help="Maximum number of concurrent uploads.",
+)
+@_chunk_size_option
+def upload(paths, url, jobs, chunk_size):
+    """Upload files into a Google Drive folder link.
+
+    An interrupted upload of a file continues where it stopped when the file is
+    uploaded to the same folder again.
+    """
+    service.upload(
+        list(paths), url, max_workers=jobs, chunk_size=chunk_size * 1024 * 1024
+    )
 
 
 cli.add_command(download)
 cli.add_command(download_folder)
+cli.add_command(upload)
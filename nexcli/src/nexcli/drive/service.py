@@ -1,23 +1,116 @@
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import functools
+import hashlib
 import importlib.resources as pkg_resources
-import io
+import json
+import os
 import re
+import shutil
+import threading
+import time
 from pathlib import Path
 
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaFileUpload
 from tqdm import tqdm
 
 # Scopes for Google Drive API
 SCOPES = ["https://www.googleapis.com/auth/drive.readonly"]
 
+# Uploading into folders that the app did not create needs write access to all of
+# Drive. Only uploads ask for it, with a token of their own, so that downloads keep
+# working with read-only tokens.
+UPLOAD_SCOPES = ["https://www.googleapis.com/auth/drive"]
+
 # Path to the credentials and token files
 OAUTH_CLIENT_CREDENTIALS = pkg_resources.path(
     "nexcli", "google_oauth_client_credentials.json"
 )
 USER_AUTH_TOKEN = Path.home() / ".nexcli/google_drive_token.json"
+UPLOAD_AUTH_TOKEN = Path.home() / ".nexcli/google_drive_upload_token.json"
+
+# Downloaded files by Drive file ID, for reusing a local copy of unchanged files
+DRIVE_CACHE = Path.home() / ".nexcli/google_drive_cache.json"
+
+# Session URIs of unfinished uploads, for resuming them
+UPLOAD_SESSIONS_DIR = Path.home() / ".nexcli/google_drive_uploads"
+
+# Credentials expiring within this margin are refreshed before they are used, so that
+# a long download does not have to recover from an expired token halfway through
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+
+# Root URL of the Drive API, None for the one in the discovery document. The
+# benchmarks point it at a local stand-in. Unlike an api_endpoint client option, it
+# also moves the upload URLs.
+API_ROOT_URL = None
+
+# Concurrent downloads of a folder, and retries of a failed file or chunk
+MAX_WORKERS = 8
+MAX_RETRIES = 3
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Seconds before retrying a failed chunk, doubled on every further attempt
+RETRY_BACKOFF = 2
+
+# Bytes requested or sent per chunk, which is also the granularity of the progress
+# updates. Upload chunks must be a multiple of 256 KiB.
+DEFAULT_CHUNK_SIZE = 16 * 1024 * 1024
+
+# Partial downloads, and their checkpoints next to them for resuming
+PART_SUFFIX = ".part"
+CHECKPOINT_SUFFIX = ".json"
+
+# File metadata needed to download and verify a file
+FILE_FIELDS = "id, name, mimeType, size, md5Checksum, modifiedTime"
+
+# Folder listings are requested with the largest page size Drive allows
+LIST_PAGE_SIZE = 1000
+FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+
+# Google Docs, Sheets, Slides and Drawings have no content of their own to download,
+# and are exported instead. The first format of each is its default.
+WORKSPACE_MIME_TYPE_PREFIX = "application/vnd.google-apps."
+EXPORT_FORMATS = {
+    "application/vnd.google-apps.document": {
+        "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        "odt": "application/vnd.oasis.opendocument.text",
+        "pdf": "application/pdf",
+        "txt": "text/plain",
+        "md": "text/markdown",
+    },
+    "application/vnd.google-apps.spreadsheet": {
+        "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        "ods": "application/vnd.oasis.opendocument.spreadsheet",
+        "csv": "text/csv",
+        "tsv": "text/tab-separated-values",
+        "pdf": "application/pdf",
+    },
+    "application/vnd.google-apps.presentation": {
+        "pptx": "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+        "odp": "application/vnd.oasis.opendocument.presentation",
+        "pdf": "application/pdf",
+    },
+    "application/vnd.google-apps.drawing": {
+        "pdf": "application/pdf",
+        "png": "image/png",
+        "svg": "image/svg+xml",
+    },
+}
+
+# Drive services are not thread-safe, so each worker thread builds its own
+_thread_local = threading.local()
+
+# Credentials by token file, and the service of the main thread, are shared by all
+# calls in a process
+_credentials = {}
+_service = None
+_lock = threading.Lock()
 
 
 # Function to extract the file ID from a Google Drive URL
@@ -38,83 +131,714 @@ def extract_folder_id(url):
         raise Exception(f"Invalid Google Drive URL: {url}")
 
 
-# Function to authenticate and create a Google Drive service
-def create_service():
-    creds = None
-    if USER_AUTH_TOKEN.exists():
-        creds = Credentials.from_authorized_user_file(str(USER_AUTH_TOKEN), SCOPES)
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            with OAUTH_CLIENT_CREDENTIALS as file:
-                flow = InstalledAppFlow.from_client_secrets_file(file, SCOPES)
-                creds = flow.run_local_server(port=0)
-        USER_AUTH_TOKEN.parent.mkdir(parents=True, exist_ok=True)
-        USER_AUTH_TOKEN.write_text(creds.to_json())
-    return build("drive", "v3", credentials=creds)
+def _expires_soon(creds):
+    if creds.expiry is None:
+        return False
+    # Credentials keep their expiry as a naive UTC datetime
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return creds.expiry - now < TOKEN_REFRESH_MARGIN
+
+
+def _load_token(token_file, scopes):
+    with open(token_file) as f:
+        info = json.load(f)
+    # A token granted for other scopes needs the user's consent again
+    if not set(scopes) <= set(info.get("scopes", [])):
+        return None
+    return Credentials.from_authorized_user_info(info, scopes)
+
+
+# Function to authenticate and return the user credentials, read from the token file
+# once per process. Uploads use credentials of their own, with write access.
+def get_credentials(for_upload=False):
+    token_file = UPLOAD_AUTH_TOKEN if for_upload else USER_AUTH_TOKEN
+    scopes = UPLOAD_SCOPES if for_upload else SCOPES
+    with _lock:
+        creds = _credentials.get(token_file)
+        if creds is None and token_file.exists():
+            creds = _load_token(token_file, scopes)
+        if not creds or not creds.valid or _expires_soon(creds):
+            if creds and creds.refresh_token:
+                # Refreshing in place also updates services built with these credentials
+                creds.refresh(Request())
+            else:
+                with OAUTH_CLIENT_CREDENTIALS as file:
+                    flow = InstalledAppFlow.from_client_secrets_file(file, scopes)
+                    creds = flow.run_local_server(port=0)
+            token_file.parent.mkdir(parents=True, exist_ok=True)
+            token_file.write_text(creds.to_json())
+        _credentials[token_file] = creds
+        return creds
+
+
+# Function to get the Drive discovery document shipped with googleapiclient, parsed
+# once per process rather than fetched or parsed for every service
+@functools.cache
+def _discovery_document():
+    return json.loads(get_static_doc("drive", "v3"))
+
+
+def _build_service(creds):
+    document = _discovery_document()
+    if API_ROOT_URL is not None:
+        document = {**document, "rootUrl": API_ROOT_URL}
+    return build_from_document(document, credentials=creds)
+
+
+# Function to authenticate and create a Google Drive service. Without explicit
+# credentials, the service is built once and shared for the rest of the process.
+def create_service(creds=None):
+    global _service
+    if creds is not None:
+        return _build_service(creds)
+    creds = get_credentials()
+    with _lock:
+        if _service is None:
+            _service = _build_service(creds)
+        return _service
+
+
+# Function to get the Drive service of the current thread for the given credentials,
+# with its own HTTP transport
+def _get_thread_service(creds):
+    if getattr(_thread_local, "creds", None) is not creds:
+        _thread_local.service = _build_service(creds)
+        _thread_local.creds = creds
+    return _thread_local.service
+
+
+def _is_retryable(ex):
+    if isinstance(ex, HttpError):
+        return ex.resp.status in RETRY_STATUSES
+    return isinstance(ex, OSError)
+
+
+# Function to get the number of bytes of a .part file that can be resumed from. A
+# .part file that was not written for the same file ID and size is removed.
+def _load_checkpoint(checkpoint_file, part_file, id, metadata):
+    try:
+        with open(checkpoint_file) as f:
+            checkpoint = json.load(f)
+        part_size = os.path.getsize(part_file)
+    except (OSError, ValueError):
+        checkpoint = None
+    # Another file downloaded to the same path, or a changed file on Drive, invalidates
+    # what was downloaded before
+    expected = {
+        "id": id,
+        "size": metadata.get("size"),
+        "md5Checksum": metadata.get("md5Checksum"),
+    }
+    if checkpoint is None or any(checkpoint.get(k) != v for k, v in expected.items()):
+        for stale_file in (part_file, checkpoint_file):
+            if os.path.exists(stale_file):
+                os.remove(stale_file)
+        return 0
+    return min(checkpoint.get("offset", 0), part_size)
 
 
-# Function to download a file from Google Drive given a shareable link
-def download(url, output_file=None):
+def _save_checkpoint(checkpoint_file, id, metadata, offset):
+    checkpoint = {
+        "id": id,
+        "size": metadata.get("size"),
+        "md5Checksum": metadata.get("md5Checksum"),
+        "offset": offset,
+    }
+    with open(checkpoint_file + ".tmp", "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(checkpoint_file + ".tmp", checkpoint_file)
+
+
+# Function to compute the md5 of a local file without reading it into memory at once
+def _md5_file(path):
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+# Function to check a download against the size and md5 that Drive reports
+def _verify_download(part_file, metadata):
+    size = metadata.get("size")
+    part_size = os.path.getsize(part_file)
+    if size is not None and part_size != int(size):
+        os.remove(part_file)
+        raise Exception(f"Downloaded {part_size} bytes, expecting {size}")
+    md5_checksum = metadata.get("md5Checksum")
+    if md5_checksum is not None and _md5_file(part_file) != md5_checksum:
+        os.remove(part_file)
+        raise Exception(f"Checksum mismatch for {part_file}")
+
+
+def _load_cache():
+    try:
+        with open(DRIVE_CACHE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache(cache):
+    DRIVE_CACHE.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = str(DRIVE_CACHE) + ".tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(cache, f, indent=2)
+    os.replace(tmp_file, DRIVE_CACHE)
+
+
+# Function to get the local copy of a file recorded in the cache, if it still has the
+# content of the file on Drive
+def _get_cached_copy(entry, metadata):
+    md5_checksum = metadata.get("md5Checksum")
+    if entry is None or md5_checksum is None:
+        return None
+    if entry.get("md5Checksum") != md5_checksum:
+        return None
+    path = entry.get("path")
+    try:
+        stat = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    # Only hash the local copy again if it was touched since it was recorded
+    if stat.st_size == entry.get("size") and stat.st_mtime_ns == entry.get("mtime"):
+        return path
+    if _md5_file(path) == md5_checksum:
+        return path
+    return None
+
+
+def _cache_entry(path, metadata):
+    stat = os.stat(path)
+    return {
+        "modifiedTime": metadata.get("modifiedTime"),
+        "md5Checksum": metadata.get("md5Checksum"),
+        "path": os.path.abspath(path),
+        "size": stat.st_size,
+        "mtime": stat.st_mtime_ns,
+    }
+
+
+# Function to get the format to export a Workspace file to, the first of the given
+# formats that its type supports or else its default. None if it is not exported.
+def _get_export_format(metadata, export_formats=()):
+    formats = EXPORT_FORMATS.get(metadata.get("mimeType"))
+    if formats is None:
+        return None
+    for export_format in export_formats:
+        if export_format in formats:
+            return export_format
+    return next(iter(formats))
+
+
+def _get_output_name(metadata, export_format):
+    name = metadata.get("name", "downloaded_file")
+    if export_format is None:
+        return name
+    return f"{name}.{export_format}"
+
+
+# Function to download a file from Google Drive given a shareable link. A file that
+# was downloaded before and has not changed on Drive is reused from its local copy.
+def download(url, output_file=None, chunk_size=DEFAULT_CHUNK_SIZE, export_formats=()):
     file_id = extract_file_id(url)
     service = create_service()
-    return download_file(service, file_id, output_file)
+    metadata = (
+        service.files()
+        .get(fileId=file_id, fields=FILE_FIELDS, supportsAllDrives=True)
+        .execute()
+    )
+    if output_file is None:
+        output_file = _get_output_name(
+            metadata, _get_export_format(metadata, export_formats)
+        )
+
+    cache = _load_cache()
+    cached_copy = _get_cached_copy(cache.get(file_id), metadata)
+    if cached_copy is None:
+        download_file(
+            service,
+            file_id,
+            output_file,
+            metadata=metadata,
+            chunk_size=chunk_size,
+            export_formats=export_formats,
+        )
+    elif os.path.abspath(cached_copy) != os.path.abspath(output_file):
+        print(f"Copying unchanged {metadata['name']} from {cached_copy}")
+        shutil.copyfile(cached_copy, output_file + PART_SUFFIX)
+        os.replace(output_file + PART_SUFFIX, output_file)
+    else:
+        print(f"{output_file} is up to date")
+
+    # Reload the cache, in case another download updated it in the meantime
+    cache = _load_cache()
+    cache[file_id] = _cache_entry(output_file, metadata)
+    _save_cache(cache)
+    return output_file
+
+
+# Function to list all entries of a folder, following the pages of the listing
+def _list_folder(service, folder_id):
+    page_token = None
+    while True:
+        results = (
+            service.files()
+            .list(
+                q=f"'{folder_id}' in parents and trashed=false",
+                fields=f"nextPageToken, files({FILE_FIELDS})",
+                pageSize=LIST_PAGE_SIZE,
+                pageToken=page_token,
+                includeItemsFromAllDrives=True,
+                supportsAllDrives=True,
+            )
+            .execute()
+        )
+        yield from results.get("files", [])
+        page_token = results.get("nextPageToken")
+        if page_token is None:
+            return
+
+
+# Function to turn a Drive name into a single local path component. Drive allows
+# slashes in names, which must not create directories. None for names like "..",
+# which would escape the folder.
+def _get_local_name(name):
+    for sep in ("/", os.sep, os.altsep):
+        if sep is not None:
+            name = name.replace(sep, "_")
+    name = name.replace("\0", "_")
+    if name.strip() in ("", ".", ".."):
+        return None
+    return name
+
+
+# Function to list all files below a folder, with their paths relative to it
+def _walk_folder(service, folder_id, path=""):
+    for entry in _list_folder(service, folder_id):
+        name = _get_local_name(entry["name"])
+        if name is None:
+            print(f"Skipping {os.path.join(path, entry['name'])}, not a valid name")
+            continue
+        entry_path = os.path.join(path, name)
+        if entry.get("mimeType") == FOLDER_MIME_TYPE:
+            yield from _walk_folder(service, entry["id"], entry_path)
+        else:
+            yield (entry_path, entry)
+
+
+# Function to check if a local file already has the content of the file on Drive
+def _is_synced(path, metadata):
+    size = metadata.get("size")
+    md5_checksum = metadata.get("md5Checksum")
+    if size is None or md5_checksum is None or not os.path.isfile(path):
+        return False
+    return os.path.getsize(path) == int(size) and _md5_file(path) == md5_checksum
 
 
-# Function to download all files from a Google Drive folder link.
-def download_folder(url):
+# Function to download all files below a Google Drive folder link, mirroring its
+# subfolders. Files that are already up to date locally are skipped, and Workspace
+# files are exported.
+def download_folder(
+    url,
+    output_dir=".",
+    max_workers=MAX_WORKERS,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    export_formats=(),
+):
     folder_id = extract_folder_id(url)
+    creds = get_credentials()
     service = create_service()
 
-    # List files in the folder
-    results = (
-        service.files()
-        .list(
-            q=f"'{folder_id}' in parents and trashed=false",
-            fields="files(id, name)",
-            includeItemsFromAllDrives=True,
-            supportsAllDrives=True,
-        )
-        .execute()
-    )
+    # List files below the folder, with the metadata needed to download them. Other
+    # Workspace types, like forms and shortcuts, can neither be downloaded nor exported.
+    files = []
+    for path, file in _walk_folder(service, folder_id):
+        mime_type = file.get("mimeType", "")
+        if mime_type.startswith(WORKSPACE_MIME_TYPE_PREFIX):
+            export_format = _get_export_format(file, export_formats)
+            if export_format is None:
+                print(f"Skipping {path}, {mime_type} files cannot be downloaded")
+                continue
+            path = f"{path}.{export_format}"
+        files.append((path, file))
+    if not files:
+        return []
+
+    # Drive allows several files of the same name in a folder. They get their file
+    # ID appended, so that no two downloads write to the same local file.
+    paths = Counter(os.path.normcase(path) for path, _ in files)
+    for i, (path, file) in enumerate(files):
+        if paths[os.path.normcase(path)] > 1:
+            root, ext = os.path.splitext(path)
+            files[i] = (f"{root} ({file['id']}){ext}", file)
+
+    for path, _ in files:
+        os.makedirs(os.path.join(output_dir, os.path.dirname(path)), exist_ok=True)
+    lock = threading.Lock()
+    num_synced = 0
+
+    with tqdm(
+        total=sum(int(file.get("size", 0)) for (_, file) in files),
+        unit="B",
+        desc=f"{len(files)} files",
+        unit_scale=True,
+        unit_divisor=1024,
+    ) as pbar:
+
+        def download_with_retry(path, file):
+            nonlocal num_synced
+            output_file = os.path.join(output_dir, path)
+            downloaded = 0
+
+            def progress(size):
+                nonlocal downloaded
+                downloaded += size
+                with lock:
+                    pbar.update(size)
+
+            if _is_synced(output_file, file):
+                progress(int(file["size"]))
+                with lock:
+                    num_synced += 1
+                return output_file
 
-    files = results.get("files", [])
-    name_len_max = max(len(file["name"]) for file in files)
-    bar_format = "{desc:<" + str(name_len_max) + "} {percentage:3.0f}%|{bar}{r_bar}"
-    for file in files:
-        download_file(service, file["id"], file["name"], bar_format=bar_format)
+            for attempt in range(MAX_RETRIES + 1):
+                try:
+                    return download_file(
+                        _get_thread_service(creds),
+                        file["id"],
+                        output_file,
+                        metadata=file,
+                        progress=progress,
+                        chunk_size=chunk_size,
+                        export_formats=export_formats,
+                    )
+                except Exception as ex:
+                    if attempt == MAX_RETRIES or not _is_retryable(ex):
+                        raise
+                    with lock:
+                        pbar.update(-downloaded)
+                        pbar.write(f"{file['name']}: {ex}, retrying.")
+                    downloaded = 0
 
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(download_with_retry, path, file)
+                for (path, file) in files
+            ]
 
-def download_file(service, id, output_file=None, bar_format=None):
-    # Extract the file name from the file metadata
-    file_metadata = service.files().get(fileId=id, supportsAllDrives=True).execute()
+    if num_synced:
+        print(f"{num_synced} of {len(files)} files were already up to date")
+    failed = []
+    for (path, _), future in zip(files, futures):
+        if future.exception() is not None:
+            print(f"Failed to download {path}: {future.exception()}")
+            failed.append(path)
+    if failed:
+        raise Exception(f"Failed to download {len(failed)} of {len(files)} files")
+    return [future.result() for future in futures]
+
+
+# Function to get a chunk of a media request, retrying transient errors
+def _request_chunk(request, headers):
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            resp, content = request.http.request(
+                request.uri, method="GET", headers=headers
+            )
+            if resp.status in RETRY_STATUSES:
+                raise HttpError(resp, content, uri=request.uri)
+            return resp, content
+        except Exception as ex:
+            if attempt == MAX_RETRIES or not _is_retryable(ex):
+                raise
+            time.sleep(RETRY_BACKOFF * 2**attempt)
+
+
+# Function to download the content of a media request into fh, from offset on, with
+# a Range request per chunk. Yields the bytes downloaded so far and the total size,
+# if known, after every chunk.
+def _download_chunks(request, fh, offset, chunk_size):
+    headers = dict(request.headers)
+    while True:
+        headers["range"] = f"bytes={offset}-{offset + chunk_size - 1}"
+        resp, content = _request_chunk(request, headers)
+        if resp.status == 416 and offset == 0:
+            # An empty file has no range to request
+            yield 0, 0
+            return
+        if resp.status not in (200, 206):
+            raise HttpError(resp, content, uri=request.uri)
+        if resp.status == 200 and offset > 0:
+            # The server ignored the range, so the content starts over
+            fh.seek(0)
+            fh.truncate()
+            offset = 0
+        fh.write(content)
+        offset += len(content)
+        content_range = resp.get("content-range")
+        # A response without a range is the whole content
+        total_size = offset if content_range is None else None
+        if content_range is not None and not content_range.endswith("/*"):
+            total_size = int(content_range.rsplit("/", 1)[1])
+        yield offset, total_size
+        if not content or (total_size is not None and offset >= total_size):
+            return
+
+
+def download_file(
+    service,
+    id,
+    output_file=None,
+    bar_format=None,
+    metadata=None,
+    progress=None,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    export_formats=(),
+):
+    # Extract the file name from the file metadata, unless it was already listed
+    if metadata is None:
+        metadata = (
+            service.files()
+            .get(fileId=id, fields=FILE_FIELDS, supportsAllDrives=True)
+            .execute()
+        )
+    export_format = _get_export_format(metadata, export_formats)
     if output_file is None:
-        output_file = file_metadata.get("name", "downloaded_file")
+        output_file = _get_output_name(metadata, export_format)
 
-    # Download the content
-    request = service.files().get_media(fileId=id)
-    fh = io.BytesIO()
-    downloader = MediaIoBaseDownload(fh, request)
+    # Stream the content into a .part file next to the output, so that memory use does
+    # not grow with the file size and the output only appears once complete. The
+    # checkpoint records how much of the .part file was written for this revision.
+    # Exports have no size or checksum to tell revisions apart, so they start over.
+    part_file = output_file + PART_SUFFIX
+    checkpoint_file = part_file + CHECKPOINT_SUFFIX
+    offset = 0
+    if export_format is None:
+        offset = _load_checkpoint(checkpoint_file, part_file, id, metadata)
+        request = service.files().get_media(fileId=id, supportsAllDrives=True)
+    else:
+        mime_type = EXPORT_FORMATS[metadata["mimeType"]][export_format]
+        request = service.files().export_media(fileId=id, mimeType=mime_type)
+    fh = open(part_file, "r+b" if offset > 0 else "wb")
+    fh.truncate(offset)
+    fh.seek(offset)
+
+    # Progress goes to the given callback, or to a progress bar of this file
+    pbar = None
+    if progress is None:
+        pbar = tqdm(
+            unit="B",
+            desc=output_file,
+            unit_scale=True,
+            unit_divisor=1024,
+            bar_format=bar_format,
+        )
+        progress = pbar.update
+    progress(offset)
+
+    # Nothing is left to request if an earlier run stopped right before the rename
+    size = metadata.get("size")
+    done = size is not None and offset == int(size)
+    last_progress = offset
+    try:
+        with fh:
+            chunks = () if done else _download_chunks(request, fh, offset, chunk_size)
+            for downloaded, total_size in chunks:
+                if pbar is not None:
+                    pbar.total = total_size
+                progress(downloaded - last_progress)
+                last_progress = downloaded
+                fh.flush()
+                if export_format is None:
+                    _save_checkpoint(checkpoint_file, id, metadata, fh.tell())
+    except BaseException:
+        # Exports cannot be resumed, so what was written of them is of no use
+        if export_format is not None:
+            os.remove(part_file)
+        raise
+    finally:
+        if pbar is not None:
+            pbar.close()
+
+    try:
+        _verify_download(part_file, metadata)
+    finally:
+        # A mismatching .part file is of no use for resuming either. Exports and
+        # empty files never get a checkpoint.
+        if os.path.exists(checkpoint_file):
+            os.remove(checkpoint_file)
+    os.replace(part_file, output_file)
+    return output_file
+
+
+def _upload_session_file(path, folder_id):
+    key = hashlib.sha1(f"{os.path.abspath(path)}:{folder_id}".encode()).hexdigest()
+    return UPLOAD_SESSIONS_DIR / f"{key}.json"
+
+
+# Function to get the session URI of an unfinished upload of a file, unless the file
+# changed since
+def _load_upload_session(session_file, path):
+    try:
+        with open(session_file) as f:
+            session = json.load(f)
+    except (OSError, ValueError):
+        return None
+    stat = os.stat(path)
+    if session.get("size") != stat.st_size or session.get("mtime") != stat.st_mtime_ns:
+        return None
+    return session.get("uri")
+
+
+def _save_upload_session(session_file, path, uri):
+    stat = os.stat(path)
+    session = {"uri": uri, "size": stat.st_size, "mtime": stat.st_mtime_ns}
+    session_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(f"{session_file}.tmp", "w") as f:
+        json.dump(session, f)
+    os.replace(f"{session_file}.tmp", session_file)
+
+
+# Function to upload files into a Google Drive folder link
+def upload(paths, url, max_workers=MAX_WORKERS, chunk_size=DEFAULT_CHUNK_SIZE):
+    folder_id = extract_folder_id(url)
+    creds = get_credentials(for_upload=True)
+    lock = threading.Lock()
 
-    done = False
-    last_progress = 0
     with tqdm(
+        total=sum(os.path.getsize(path) for path in paths),
         unit="B",
-        desc=output_file,
+        desc=f"{len(paths)} files",
         unit_scale=True,
         unit_divisor=1024,
-        bar_format=bar_format,
     ) as pbar:
-        while not done:
-            status, done = downloader.next_chunk()
-            pbar.total = status.total_size
-            pbar.update(status.resumable_progress - last_progress)
-            last_progress = status.resumable_progress
 
-    # Save to local file
-    with open(output_file, "wb") as f:
-        fh.seek(0)
-        f.write(fh.read())
+        def progress(size):
+            with lock:
+                pbar.update(size)
 
-    return output_file
+        def upload_path(path):
+            return upload_file(
+                _get_thread_service(creds),
+                path,
+                folder_id,
+                progress=progress,
+                chunk_size=chunk_size,
+            )
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(upload_path, path) for path in paths]
+
+    failed = []
+    for path, future in zip(paths, futures):
+        if future.exception() is not None:
+            print(f"Failed to upload {path}: {future.exception()}")
+            failed.append(path)
+        else:
+            file = future.result()
+            print(f"Uploaded {path}: https://drive.google.com/file/d/{file['id']}/view")
+    if failed:
+        raise Exception(f"Failed to upload {len(failed)} of {len(paths)} files")
+    return [future.result() for future in futures]
+
+
+# Function to ask a resumable upload session how many bytes it received so far. Also
+# returns the metadata of the uploaded file if the upload is already complete.
+def _get_upload_status(request, uri, size):
+    headers = {"Content-Length": "0", "Content-Range": f"bytes */{size}"}
+    resp, content = request.http.request(uri, method="PUT", headers=headers)
+    if resp.status in (200, 201):
+        return size, json.loads(content)
+    if resp.status != 308:
+        raise HttpError(resp, content, uri=uri)
+    # The range of received bytes is like `bytes=0-1234`, or missing if there are none
+    if "range" not in resp:
+        return 0, None
+    return int(resp["range"].rsplit("-", 1)[1]) + 1, None
+
+
+def upload_file(service, path, folder_id, progress=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    # Upload through a resumable session, whose URI is kept until the upload finishes
+    # so that an interrupted upload continues where it stopped
+    media = MediaFileUpload(path, chunksize=chunk_size, resumable=True)
+    request = service.files().create(
+        body={"name": os.path.basename(path), "parents": [folder_id]},
+        media_body=media,
+        fields="id, name, size, md5Checksum",
+        supportsAllDrives=True,
+    )
+    session_file = _upload_session_file(path, folder_id)
+    uri = _load_upload_session(session_file, path)
+
+    # Progress goes to the given callback, or to a progress bar of this file
+    pbar = None
+    if progress is None:
+        pbar = tqdm(
+            total=media.size(),
+            unit="B",
+            desc=path,
+            unit_scale=True,
+            unit_divisor=1024,
+        )
+        progress = pbar.update
+
+    response = None
+    uploaded = 0
+    last_progress = 0
+    num_errors = 0
+    # A stored session, or one whose chunk failed, is first asked how much it
+    # received. The next chunk is sent from there.
+    check_status = uri is not None
+    try:
+        while response is None:
+            # googleapiclient retries a chunk by sending its already consumed stream
+            # again, so failed chunks are retried here instead
+            try:
+                if check_status:
+                    uploaded, response = _get_upload_status(request, uri, media.size())
+                    request.resumable_uri = uri
+                    request.resumable_progress = uploaded
+                    check_status = False
+                else:
+                    status, response = request.next_chunk()
+                    if status is not None:
+                        uploaded = status.resumable_progress
+            except Exception as ex:
+                if (
+                    uri is not None
+                    and isinstance(ex, HttpError)
+                    and ex.resp.status in (404, 410)
+                ):
+                    # The session expired, so the upload starts over in a new one
+                    if os.path.exists(session_file):
+                        os.remove(session_file)
+                    request.resumable_uri = uri = None
+                    request.resumable_progress = uploaded = 0
+                    check_status = False
+                    continue
+                num_errors += 1
+                if num_errors > MAX_RETRIES or not _is_retryable(ex):
+                    raise
+                check_status = request.resumable_uri is not None
+                time.sleep(RETRY_BACKOFF * 2 ** (num_errors - 1))
+            else:
+                num_errors = 0
+            if request.resumable_uri != uri:
+                uri = request.resumable_uri
+                _save_upload_session(session_file, path, uri)
+            progress(uploaded - last_progress)
+            last_progress = uploaded
+        progress(media.size() - last_progress)
+    finally:
+        media.stream().close()
+        if pbar is not None:
+            pbar.close()
+    if os.path.exists(session_file):
+        os.remove(session_file)
+
+    md5_checksum = response.get("md5Checksum")
+    if md5_checksum is not None and _md5_file(path) != md5_checksum:
+        raise Exception(f"Checksum mismatch for uploaded {path}")
+    return response